@@ -1,3 +1,5 @@
+# 节点模块在加载时只导入纯Python模块 (选项列表/计时工具), torch/numpy/PIL 和合成引擎在节点第一次执行时才导入
+# 节点构造时不做任何文件系统操作
 from .image_overlay_node import ImageOverlayNode
 from .image_overlay_preview_node import ImageOverlayPreviewNode
 from .image_coordinate_picker_node import ImageCoordinatePickerNode
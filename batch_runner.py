@@ -0,0 +1,168 @@
+import collections
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+from PIL import Image
+
+from .image_overlay_node import ImageOverlayNode
+
+# 无界面批处理: 把同一张修改图合成到目录或清单中的大量底图上, 不经过ComfyUI图执行
+# 解码和编码在后台I/O线程池中进行, 与主线程的合成重叠; 修改图只加载一次, 变换结果在所有底图间复用
+
+IMAGE_EXTENSIONS = (".png", ".jpg", ".jpeg", ".webp", ".bmp", ".tif", ".tiff")
+
+SAVE_FORMATS = {
+    "png": ("PNG", ".png"),
+    "jpg": ("JPEG", ".jpg"),
+    "webp": ("WEBP", ".webp"),
+}
+
+
+def iter_jobs(source, recursive=False):
+    # source 为目录 (按文件名排序) 或清单文件
+    # 清单: .json 为路径或 {"image": 路径, "coordinates": ..., "output": 文件名} 的列表, 其他格式每行一个路径
+    # 返回 (底图路径, 坐标或None, 输出文件名或None)
+    if os.path.isdir(source):
+        if recursive:
+            paths = [os.path.join(root, name) for root, _, names in os.walk(source) for name in names]
+        else:
+            paths = [os.path.join(source, name) for name in os.listdir(source)]
+        for path in sorted(p for p in paths if p.lower().endswith(IMAGE_EXTENSIONS)):
+            yield path, None, None
+        return
+
+    base_dir = os.path.dirname(os.path.abspath(source))
+    if source.lower().endswith(".json"):
+        with open(source, encoding="utf-8") as f:
+            entries = json.load(f)
+        for entry in entries:
+            if isinstance(entry, str):
+                entry = {"image": entry}
+            coordinates = entry.get("coordinates")
+            if coordinates is not None and not isinstance(coordinates, str):
+                coordinates = json.dumps(coordinates)
+            yield os.path.join(base_dir, entry["image"]), coordinates, entry.get("output")
+        return
+
+    with open(source, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield os.path.join(base_dir, line), None, None
+
+
+def load_image(path):
+    # 读取为 (1, H, W, C) float32 张量, 有透明通道时保留RGBA
+    with Image.open(path) as image:
+        mode = "RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB"
+        array = np.asarray(image.convert(mode), dtype=np.float32)
+    return torch.from_numpy(array / 255.0).unsqueeze(0)
+
+
+def save_image(image, path, output_format, quality=95):
+    # image 为单帧 (H, W, C) 张量; jpg 只保存RGB
+    pil_format, _ = SAVE_FORMATS[output_format]
+    array = (image.clamp(0.0, 1.0) * 255).round().to(torch.uint8).cpu().numpy()
+    if output_format == "jpg":
+        array = array[..., :3]
+    options = {"quality": quality} if output_format in ("jpg", "webp") else {"compress_level": 4}
+    Image.fromarray(array).save(path, pil_format, **options)
+
+
+def source_root(source):
+    # 输出路径相对的根目录: 目录本身, 或清单文件所在目录
+    if os.path.isdir(source):
+        return os.path.abspath(source)
+    return os.path.dirname(os.path.abspath(source))
+
+
+def output_path(output_dir, image_path, output_name, output_format, root=None):
+    # 默认保持底图相对root的子目录结构 (root之外的底图只用文件名), 扩展名换成输出格式
+    extension = SAVE_FORMATS[output_format][1]
+    if output_name:
+        name = output_name if os.path.splitext(output_name)[1] else output_name + extension
+    else:
+        relative = os.path.relpath(os.path.abspath(image_path), root) if root else os.path.basename(image_path)
+        if relative.startswith(os.pardir):
+            relative = os.path.basename(image_path)
+        name = os.path.splitext(relative)[0] + extension
+    return os.path.join(output_dir, name)
+
+
+def run_batch(source, overlay_path, output_dir, coordinates='[{"x": 0, "y": 0}]', scale=1.0, rotation=0.0,
+              flip_horizontal=False, flip_vertical=False, blend_mode="normal", opacity=1.0, output_format="png",
+              io_workers=4, quality=95, recursive=False, skip_existing=False, **node_options):
+    # node_options 原样传给 ImageOverlayNode.overlay_images (backend, placement, alpha_mode, resample 等)
+    # 多张底图映射到同一输出路径时 (如 x.png 和 x.jpg), 第一张之后的记为失败, 不会互相覆盖
+    # 返回 {"done": 成功数, "skipped": 跳过数, "failed": [(路径, 错误), ...]}
+    os.makedirs(output_dir, exist_ok=True)
+    node = ImageOverlayNode()
+    overlay = load_image(overlay_path)
+    summary = {"done": 0, "skipped": 0, "failed": []}
+
+    jobs = []
+    targets = {}
+    root = source_root(source)
+    for image_path, job_coordinates, output_name in iter_jobs(source, recursive):
+        target = output_path(output_dir, image_path, output_name, output_format, root)
+        key = os.path.normcase(os.path.abspath(target))
+        if key in targets:
+            error = f"输出路径与 {targets[key]} 重复: {target}"
+            print(f"Error compositing {image_path}: {error}")
+            summary["failed"].append((image_path, error))
+            continue
+        targets[key] = image_path
+        if skip_existing and os.path.exists(target):
+            summary["skipped"] += 1
+            continue
+        jobs.append((image_path, job_coordinates or coordinates, target))
+
+    with ThreadPoolExecutor(max_workers=max(1, io_workers), thread_name_prefix="hbh-batch-io") as pool:
+        # 预读窗口: 最多提前解码 2*io_workers 张, 控制内存占用
+        pending = collections.deque()
+        writes = []
+        job_iter = iter(jobs)
+
+        def submit_next():
+            job = next(job_iter, None)
+            if job is not None:
+                pending.append((job, pool.submit(load_image, job[0])))
+
+        for _ in range(max(1, io_workers) * 2):
+            submit_next()
+
+        while pending:
+            (image_path, job_coordinates, target), future = pending.popleft()
+            submit_next()
+            try:
+                base = future.result()
+                result, _, _ = node.overlay_images(base, overlay, job_coordinates, scale, rotation, flip_horizontal, flip_vertical,
+                                                   blend_mode, opacity, output_format, **node_options)
+            except Exception as e:
+                print(f"Error compositing {image_path}: {str(e)}")
+                summary["failed"].append((image_path, str(e)))
+                continue
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            writes.append((image_path, pool.submit(save_image, result[0], target, output_format, quality)))
+
+            # 及时回收已完成的写入; 编码跟不上时等待最早的写入, 避免结果张量堆积
+            while writes and (writes[0][1].done() or len(writes) > max(1, io_workers) * 2):
+                collect_write(writes.pop(0), summary)
+
+        for write in writes:
+            collect_write(write, summary)
+
+    return summary
+
+
+def collect_write(write, summary):
+    image_path, future = write
+    try:
+        future.result()
+        summary["done"] += 1
+    except Exception as e:
+        print(f"Error saving {image_path}: {str(e)}")
+        summary["failed"].append((image_path, str(e)))
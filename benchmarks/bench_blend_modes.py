@@ -0,0 +1,80 @@
+import argparse
+import time
+
+import numpy as np
+
+from common import load_module
+
+blend_modes = load_module("blend_modes")
+
+
+def reference_blend(base, overlay, mode):
+    # 旧版ImageOverlayNode.apply_blend_mode (布尔索引实现), 作为对照
+    if mode == "normal":
+        return overlay
+    elif mode == "multiply":
+        return base * overlay
+    elif mode == "screen":
+        return 1 - (1 - base) * (1 - overlay)
+    elif mode == "overlay":
+        mask = base > 0.5
+        result = np.zeros_like(base)
+        result[mask] = 1 - 2 * (1 - base[mask]) * (1 - overlay[mask])
+        result[~mask] = 2 * base[~mask] * overlay[~mask]
+        return result
+    elif mode == "soft_light":
+        mask = overlay > 0.5
+        result = np.zeros_like(base)
+        result[mask] = base[mask] * (1 - (1 - base[mask]) * (1 - (overlay[mask] - 0.5) * 2))
+        result[~mask] = base[~mask] * (1 + (2 * overlay[~mask] - 1) * base[~mask])
+        return result
+    elif mode == "hard_light":
+        mask = overlay > 0.5
+        result = np.zeros_like(base)
+        result[mask] = 1 - 2 * (1 - base[mask]) * (1 - overlay[mask])
+        result[~mask] = 2 * base[~mask] * overlay[~mask]
+        return result
+    elif mode == "color_dodge":
+        return np.minimum(1, base / (1 - overlay + 1e-6))
+    elif mode == "color_burn":
+        return 1 - np.minimum(1, (1 - base) / (overlay + 1e-6))
+    elif mode == "darken":
+        return np.minimum(base, overlay)
+    elif mode == "lighten":
+        return np.maximum(base, overlay)
+    return overlay
+
+
+def measure(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description="混合模式内核与旧实现的吞吐量对比")
+    parser.add_argument("--width", type=int, default=1920)
+    parser.add_argument("--height", type=int, default=1080)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    base = rng.random((args.height, args.width, 4), dtype=np.float32)
+    overlay = rng.random((args.height, args.width, 4), dtype=np.float32)
+    out = np.empty_like(base)
+    megapixels = args.width * args.height / 1e6
+
+    print(f"{'mode':<12} {'reference MP/s':>15} {'kernel MP/s':>12} {'speedup':>8} {'max diff':>10}")
+    for mode in blend_modes.BLEND_MODES:
+        reference_time = measure(lambda: reference_blend(base, overlay, mode), args.repeat)
+        kernel_time = measure(lambda: blend_modes.blend(base, overlay, mode, out=out), args.repeat)
+        diff = np.abs(np.clip(reference_blend(base, overlay, mode), 0, 1) - np.clip(out, 0, 1)).max()
+        print(f"{mode:<12} {megapixels / reference_time:>15.1f} {megapixels / kernel_time:>12.1f} "
+              f"{reference_time / kernel_time:>7.2f}x {diff:>10.2e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+import argparse
+import gc
+import itertools
+import json
+import os
+import platform
+import statistics
+import threading
+import time
+import tracemalloc
+
+import torch
+
+from common import load_package, load_module
+
+# 节点基准: 用合成张量在CPU上测量 ImageOverlayNode / ImageOverlayPreviewNode / draw_point
+# 默认以基准配置为中心逐项扫描各参数, --full 时做全组合
+
+RESOLUTIONS = {
+    "512": (512, 512),
+    "1k": (1024, 576),
+    "2k": (1920, 1080),
+    "4k": (3840, 2160),
+    "8k": (7680, 4320),
+}
+
+BASELINE = {
+    "resolution": "2k",
+    "overlay_size": 256,
+    "batch": 1,
+    "blend_mode": "normal",
+    "transform": "1.0:0:0:0",
+    "opacity": 1.0,
+    "backend": "tensor",
+}
+
+
+class MemorySampler:
+    # 峰值内存: 后台线程采样进程RSS (Linux), 同时用tracemalloc统计Python/NumPy分配
+    def __init__(self, interval=0.002):
+        self.interval = interval
+        self.peak_rss = 0
+        self.start_rss = 0
+        self.traced_peak = 0
+        self.running = False
+        self.thread = None
+
+    @staticmethod
+    def rss():
+        try:
+            with open("/proc/self/statm") as f:
+                return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+        except (OSError, ValueError):
+            return 0
+
+    def sample(self):
+        while self.running:
+            self.peak_rss = max(self.peak_rss, self.rss())
+            time.sleep(self.interval)
+
+    def __enter__(self):
+        gc.collect()
+        self.start_rss = self.peak_rss = self.rss()
+        tracemalloc.start()
+        self.running = True
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.running = False
+        self.thread.join()
+        self.peak_rss = max(self.peak_rss, self.rss())
+        self.traced_peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    def peak_bytes(self):
+        return max(self.peak_rss - self.start_rss, self.traced_peak)
+
+
+def parse_list(value, cast=str):
+    return [cast(v) for v in value.split(",") if v.strip()]
+
+
+def parse_transform(value):
+    scale, rotation, flip_h, flip_v = value.split(":")
+    return float(scale), float(rotation), flip_h == "1", flip_v == "1"
+
+
+def measure(fn, repeat):
+    # 第一次为冷启动 (清空变换缓存), 之后为热运行; 内存峰值覆盖全部运行
+    # 分配器会复用之前用例释放的内存, 所以同时记录增量和进程绝对峰值
+    transform_cache = load_module("transform_cache")
+    transform_cache.TRANSFORM_CACHE.clear()
+    warm = []
+    with MemorySampler() as memory:
+        start = time.perf_counter()
+        fn()
+        cold = time.perf_counter() - start
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fn()
+            warm.append(time.perf_counter() - start)
+    return {
+        "cold_s": cold,
+        "warm_min_s": min(warm),
+        "warm_median_s": statistics.median(warm),
+        "peak_memory_bytes": memory.peak_bytes(),
+        "peak_rss_bytes": memory.peak_rss,
+    }
+
+
+def overlay_cases(args):
+    axes = {
+        "resolution": args.resolutions,
+        "overlay_size": args.overlay_sizes,
+        "batch": args.batches,
+        "blend_mode": args.blend_modes,
+        "transform": args.transforms,
+        "opacity": args.opacities,
+        "backend": args.backends,
+    }
+    if args.full:
+        names = list(axes)
+        for values in itertools.product(*(axes[name] for name in names)):
+            yield dict(zip(names, values))
+        return
+    # 单轴扫描的基准取默认BASELINE值; 该值不在传入的列表中时取列表第一个, 只运行用户指定的取值
+    baseline = {name: BASELINE[name] if BASELINE[name] in values else values[0] for name, values in axes.items()}
+    seen = set()
+    for name, values in axes.items():
+        for value in values:
+            case = dict(baseline, **{name: value})
+            key = tuple(sorted(case.items()))
+            if key not in seen:
+                seen.add(key)
+                yield case
+
+
+def run_overlay_case(node, case, repeat):
+    width, height = RESOLUTIONS[case["resolution"]]
+    base = torch.rand(case["batch"], height, width, 3)
+    overlay = torch.rand(1, case["overlay_size"], case["overlay_size"], 4)
+    scale, rotation, flip_h, flip_v = parse_transform(case["transform"])
+    coordinates = json.dumps([{"x": width // 4, "y": height // 4}])
+
+    def fn():
+        node.overlay_images(base, overlay, coordinates, scale, rotation, flip_h, flip_v,
+                            case["blend_mode"], case["opacity"], "png", backend=case["backend"])
+
+    result = measure(fn, repeat)
+    result["images_per_s"] = case["batch"] / result["warm_min_s"]
+    return result
+
+
+def run_preview_case(node, resolution, overlay_size, repeat):
+    width, height = RESOLUTIONS[resolution]
+    base = torch.rand(1, height, width, 3)
+    overlay = torch.rand(1, overlay_size, overlay_size, 4)
+    state = {"position_x": width // 4, "position_y": height // 4, "scale": 1.0,
+             "rotation": 15.0, "blend_mode": "normal", "opacity": 0.8}
+    result = measure(lambda: node.preview_overlay(base, overlay, state), repeat)
+    result["images_per_s"] = 1 / result["warm_min_s"]
+    return result
+
+
+def run_draw_point_case(node, resolution, point_size, repeat):
+    width, height = RESOLUTIONS[resolution]
+    image = torch.rand(1, height, width, 3)
+    result = measure(lambda: node.draw_point(image, width // 2, height // 2, "red", point_size), repeat)
+    result["images_per_s"] = 1 / result["warm_min_s"]
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="HBH image overlay 节点基准")
+    parser.add_argument("--resolutions", type=parse_list, default=list(RESOLUTIONS))
+    parser.add_argument("--overlay-sizes", type=lambda v: parse_list(v, int), default=[64, 256, 1024])
+    parser.add_argument("--batches", type=lambda v: parse_list(v, int), default=[1, 4, 16])
+    parser.add_argument("--blend-modes", type=parse_list, default=None)
+    parser.add_argument("--transforms", type=parse_list, default=["1.0:0:0:0", "0.5:0:1:0", "1.5:30:0:1", "2.0:90:1:1"],
+                        help="scale:rotation:flip_h:flip_v")
+    parser.add_argument("--opacities", type=lambda v: parse_list(v, float), default=[1.0, 0.5])
+    parser.add_argument("--backends", type=parse_list, default=["tensor", "pil"])
+    parser.add_argument("--point-sizes", type=lambda v: parse_list(v, int), default=[5, 50])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--full", action="store_true", help="全组合扫描 (用时很长)")
+    parser.add_argument("--json", dest="json_path", help="把结果写入JSON文件")
+    args = parser.parse_args()
+
+    package = load_package()
+    blend_modes = load_module("blend_modes")
+    if args.blend_modes is None:
+        args.blend_modes = list(blend_modes.BLEND_MODES)
+
+    overlay_node = package.NODE_CLASS_MAPPINGS["HBH_ImageOverlay"]()
+    preview_node = package.NODE_CLASS_MAPPINGS["HBH_ImageOverlayPreview"]()
+    coordinate_preview_node = package.NODE_CLASS_MAPPINGS["HBH_ImageCoordinatePreview"]()
+
+    results = []
+
+    def report(benchmark, case, result):
+        results.append({"benchmark": benchmark, "case": case, "result": result})
+        case_text = " ".join(f"{k}={v}" for k, v in case.items())
+        print(f"{benchmark:<14} {case_text:<100} {result['warm_min_s'] * 1000:>9.1f} ms "
+              f"{result['images_per_s']:>8.2f} img/s {result['peak_memory_bytes'] / 2**20:>8.1f} MiB")
+
+    for case in overlay_cases(args):
+        report("overlay", case, run_overlay_case(overlay_node, case, args.repeat))
+    for resolution in args.resolutions:
+        for overlay_size in args.overlay_sizes:
+            case = {"resolution": resolution, "overlay_size": overlay_size}
+            report("preview", case, run_preview_case(preview_node, resolution, overlay_size, args.repeat))
+        for point_size in args.point_sizes:
+            case = {"resolution": resolution, "point_size": point_size}
+            report("draw_point", case, run_draw_point_case(coordinate_preview_node, resolution, point_size, args.repeat))
+
+    if args.json_path:
+        with open(args.json_path, "w") as f:
+            json.dump({
+                "machine": {
+                    "platform": platform.platform(),
+                    "python": platform.python_version(),
+                    "torch": torch.__version__,
+                    "cpu_count": os.cpu_count(),
+                    "torch_threads": torch.get_num_threads(),
+                },
+                "results": results,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
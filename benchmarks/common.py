@@ -0,0 +1,26 @@
+import importlib.util
+import os
+import sys
+
+# 基准脚本在ComfyUI之外独立运行, 这里把仓库目录作为包加载以支持相对导入
+PACKAGE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PACKAGE_NAME = "hbh_image_overlay"
+
+
+def load_package():
+    if PACKAGE_NAME in sys.modules:
+        return sys.modules[PACKAGE_NAME]
+    spec = importlib.util.spec_from_file_location(
+        PACKAGE_NAME,
+        os.path.join(PACKAGE_DIR, "__init__.py"),
+        submodule_search_locations=[PACKAGE_DIR],
+    )
+    package = importlib.util.module_from_spec(spec)
+    sys.modules[PACKAGE_NAME] = package
+    spec.loader.exec_module(package)
+    return package
+
+
+def load_module(name):
+    load_package()
+    return importlib.import_module(f"{PACKAGE_NAME}.{name}")
@@ -0,0 +1,168 @@
+import functools
+
+import numpy as np
+import torch
+from .options import BLEND_MODES
+
+# 混合模式内核: 每种模式都是无分支的原地运算链, 同时支持numpy数组和torch张量
+# 内核签名为 kernel(base, overlay, out), 第一步运算直接写入out, out可以就是base本身
+
+def _is_tensor(x):
+    return isinstance(x, torch.Tensor)
+
+
+def _mul(a, b, out):
+    if _is_tensor(out):
+        return torch.mul(a, b, out=out)
+    return np.multiply(a, b, out=out)
+
+
+def _minimum(a, b, out):
+    if _is_tensor(out):
+        return torch.minimum(a, b, out=out)
+    return np.minimum(a, b, out=out)
+
+
+def _maximum(a, b, out):
+    if _is_tensor(out):
+        return torch.maximum(a, b, out=out)
+    return np.maximum(a, b, out=out)
+
+
+def _clip(out, low, high):
+    if _is_tensor(out):
+        return out.clamp_(low, high)
+    return np.clip(out, low, high, out=out)
+
+
+def _select(keep, a, out):
+    # out = where(keep, out, a); numpy下用算术选择代替随机掩码的分支写入
+    if _is_tensor(out):
+        return torch.where(keep, out, a, out=out)
+    out -= a
+    out *= keep
+    out += a
+    return out
+
+
+def _normal(base, overlay, out):
+    out[...] = overlay
+
+
+def _multiply(base, overlay, out):
+    _mul(base, overlay, out)
+
+
+def _screen(base, overlay, out):
+    # b + o - b*o
+    product = base * overlay
+    out[...] = base
+    out += overlay
+    out -= product
+
+
+def _light(base, overlay, out, high):
+    # high处: 2(b+o) - 2bo - 1, 其余: 2bo
+    product = base * overlay
+    out[...] = base
+    out += overlay
+    out -= product
+    out *= 2
+    out -= 1
+    product *= 2
+    _select(high, product, out)
+
+
+def _overlay(base, overlay, out):
+    _light(base, overlay, out, base > 0.5)
+
+
+def _hard_light(base, overlay, out):
+    _light(base, overlay, out, overlay > 0.5)
+
+
+def _soft_light(base, overlay, out):
+    # k = 2o - 1; o > 0.5: b(b + k - kb), 否则: b(1 + kb); 两支都在写out之前算完, 允许out就是base
+    high = overlay > 0.5
+    k = overlay * 2 - 1
+    low = base * k
+    result = base - low
+    result += k
+    result *= base
+    low *= base
+    low += base
+    out[...] = result
+    _select(high, low, out)
+
+
+def _color_dodge(base, overlay, out):
+    divisor = 1 - overlay + 1e-6
+    out[...] = base
+    out /= divisor
+    _clip(out, None, 1)
+
+
+def _color_burn(base, overlay, out):
+    # 1 - min(1, (1-b)/(o+eps)) == max(0, 1 - (1-b)/(o+eps))
+    divisor = overlay + 1e-6
+    out[...] = base
+    out -= 1
+    out /= divisor
+    out += 1
+    _clip(out, 0, None)
+
+
+def _darken(base, overlay, out):
+    _minimum(base, overlay, out)
+
+
+def _lighten(base, overlay, out):
+    _maximum(base, overlay, out)
+
+
+BLEND_KERNELS = {
+    "normal": _normal,
+    "multiply": _multiply,
+    "screen": _screen,
+    "overlay": _overlay,
+    "soft_light": _soft_light,
+    "hard_light": _hard_light,
+    "color_dodge": _color_dodge,
+    "color_burn": _color_burn,
+    "darken": _darken,
+    "lighten": _lighten,
+}
+
+
+def blend(base, overlay, mode, out=None):
+    # out为None时分配新的float32缓冲; 传入out=base可原地混合
+    if out is None:
+        if isinstance(base, torch.Tensor):
+            shape = torch.broadcast_shapes(base.shape, overlay.shape)
+            out = torch.empty(shape, dtype=torch.float32, device=base.device)
+        else:
+            shape = np.broadcast_shapes(base.shape, overlay.shape)
+            out = np.empty(shape, dtype=np.float32)
+    BLEND_KERNELS.get(mode, _normal)(base, overlay, out)
+    return out
+
+
+@functools.lru_cache(maxsize=None)
+def blend_table(mode):
+    # 8位查表: table[b * 256 + o] = 对 b/255, o/255 运行同一个float32内核后截断到uint8, 与浮点路径逐位一致
+    # 每种模式第一次使用时生成 (256x256, 64KB)
+    levels = np.arange(256, dtype=np.float32) / 255.0
+    base, overlay = np.meshgrid(levels, levels, indexing="ij")
+    result = blend(base, overlay, mode)
+    np.clip(result, 0, 1, out=result)
+    table = (result * 255).astype(np.uint8).ravel()
+    table.setflags(write=False)
+    return table
+
+
+def blend_u8(base, overlay, mode, out=None):
+    # 直接在uint8数组上查表混合, 不经过float32转换; out可以就是base
+    index = base.astype(np.uint16)
+    index <<= 8
+    index |= overlay
+    return np.take(blend_table(mode), index, out=out, mode="clip")
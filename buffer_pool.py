@@ -0,0 +1,79 @@
+import threading
+from collections import OrderedDict
+
+import torch
+
+# 预分配缓冲池: 按 (用途, 帧形状, 类型, 设备) 复用张量, 避免每次执行都重新分配整批大块内存
+# 同一个键的缓冲按批次只增不减, 返回前 batch 帧的视图; 内容未初始化, 由调用方完整写入
+# 复用的缓冲在下一次相同用途的请求时会被覆盖
+
+
+def dtype_for(precision):
+    # options.PRECISIONS 中的名称 -> torch 类型
+    return getattr(torch, precision)
+
+
+def shares_memory(a, b):
+    # 两个张量是否位于同一块存储上 (视图/切片也算)
+    return a.device == b.device and a.untyped_storage().data_ptr() == b.untyped_storage().data_ptr()
+
+
+class BufferPool:
+    def __init__(self, max_entries=16, max_bytes=2048 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def acquire(self, owner, shape, dtype=torch.float32, device="cpu"):
+        # 返回 shape 形状的视图; owner 区分用途 (同一owner的上一次结果会被覆盖)
+        batch, frame = shape[0], tuple(shape[1:])
+        key = (owner, frame, dtype, str(device))
+        with self.lock:
+            buffer = self.entries.get(key)
+            if buffer is not None and buffer.shape[0] >= batch:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return buffer[:batch]
+            self.misses += 1
+            if buffer is not None:
+                self.total_bytes -= buffer.numel() * buffer.element_size()
+                del self.entries[key]
+
+        buffer = torch.empty((batch,) + frame, dtype=dtype, device=device)
+        size = buffer.numel() * buffer.element_size()
+        with self.lock:
+            # 单个缓冲超过字节上限时不保留
+            if size <= self.max_bytes:
+                self.entries[key] = buffer
+                self.total_bytes += size
+                while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                    _, evicted = self.entries.popitem(last=False)
+                    self.total_bytes -= evicted.numel() * evicted.element_size()
+        return buffer
+
+    def scratch(self, name, shape, device="cpu"):
+        # 每个线程独立的float32工作缓冲, 并行的块之间互不覆盖
+        return self.acquire(("scratch", name, threading.get_ident()), shape, torch.float32, device)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+BUFFER_POOL = BufferPool()
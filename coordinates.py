@@ -0,0 +1,83 @@
+import functools
+import json
+import numbers
+
+import numpy as np
+
+# 共用的坐标模型: 同时接受单个点 {"x":..,"y":..}, 点列表 [{"x":..,"y":..}, ...] 和 [[x, y], ...]
+# 解析结果以 Nx2 数组保存, 按原始字符串缓存; 格式错误时抛出 ValueError, 不再静默放到 (0, 0)
+
+# 每个点可以覆盖节点参数的键
+OVERRIDE_KEYS = ("scale", "rotation", "opacity")
+# 从第一个点读取的附加信息 (坐标预览节点使用)
+META_KEYS = ("point_color", "point_size")
+
+
+class PointSet:
+    # xy: (N, 2) float64; overrides: 键 -> (N,) float64, 未指定的点为NaN; meta: 第一个点的附加信息
+    def __init__(self, xy, overrides, meta):
+        self.xy = xy
+        self.overrides = overrides
+        self.meta = meta
+        # 缓存结果被多次复用, 设为只读
+        self.xy.setflags(write=False)
+        for values in self.overrides.values():
+            values.setflags(write=False)
+
+    def __len__(self):
+        return self.xy.shape[0]
+
+    def override(self, key, index, default):
+        values = self.overrides.get(key)
+        if values is None or np.isnan(values[index]):
+            return default
+        return float(values[index])
+
+
+def _number(value, where):
+    if isinstance(value, bool) or not isinstance(value, numbers.Real):
+        raise ValueError(f"{where} 不是数字: {value!r}")
+    return value
+
+
+def _from_json(data):
+    if isinstance(data, dict):
+        data = [data]
+    if not isinstance(data, list):
+        raise ValueError(f"坐标必须是点或点列表, 实际为 {type(data).__name__}")
+    if len(data) == 0:
+        raise ValueError("坐标列表为空")
+
+    count = len(data)
+    xy = np.empty((count, 2), dtype=np.float64)
+    overrides = {}
+    for i, point in enumerate(data):
+        if isinstance(point, dict):
+            if "x" not in point or "y" not in point:
+                raise ValueError(f"第 {i} 个点缺少 x 或 y: {point!r}")
+            xy[i, 0] = _number(point["x"], f"第 {i} 个点的 x")
+            xy[i, 1] = _number(point["y"], f"第 {i} 个点的 y")
+            for key in OVERRIDE_KEYS:
+                if key in point:
+                    if key not in overrides:
+                        overrides[key] = np.full(count, np.nan)
+                    overrides[key][i] = _number(point[key], f"第 {i} 个点的 {key}")
+        elif isinstance(point, (list, tuple)) and len(point) == 2:
+            xy[i, 0] = _number(point[0], f"第 {i} 个点的 x")
+            xy[i, 1] = _number(point[1], f"第 {i} 个点的 y")
+        else:
+            raise ValueError(f"第 {i} 个点格式错误: {point!r}")
+
+    first = data[0] if isinstance(data[0], dict) else {}
+    meta = {key: first[key] for key in META_KEYS if key in first}
+    return PointSet(xy, overrides, meta)
+
+
+@functools.lru_cache(maxsize=64)
+def parse_coordinates(text):
+    # 同一字符串只解析一次; 返回的 PointSet 是只读的, 调用方不要修改
+    try:
+        data = json.loads(text)
+    except (TypeError, json.JSONDecodeError) as e:
+        raise ValueError(f"坐标不是有效的JSON: {e}") from None
+    return _from_json(data)
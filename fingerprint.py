@@ -0,0 +1,27 @@
+import hashlib
+
+import numpy as np
+import torch
+from .transform_cache import tensor_digest
+
+# IS_CHANGED 使用的输入指纹: 参数元组加张量摘要, 输入不变时指纹不变, ComfyUI 即可复用缓存结果
+
+
+def value_fingerprint(value):
+    if isinstance(value, torch.Tensor):
+        # 非CPU张量也拷回主机做内容哈希 (按对象和版本号缓存, 同一张量只拷贝一次)
+        return "tensor:" + tensor_digest(value)
+    if isinstance(value, np.ndarray):
+        return "array:" + tensor_digest(value)
+    if isinstance(value, dict):
+        return "{" + ",".join(f"{k!r}:{value_fingerprint(v)}" for k, v in sorted(value.items(), key=lambda kv: str(kv[0]))) + "}"
+    if isinstance(value, (list, tuple)):
+        return "[" + ",".join(value_fingerprint(v) for v in value) + "]"
+    return repr(value)
+
+
+def inputs_fingerprint(**kwargs):
+    digest = hashlib.blake2b(digest_size=16)
+    for name in sorted(kwargs):
+        digest.update(f"{name}={value_fingerprint(kwargs[name])};".encode())
+    return digest.hexdigest()
@@ -1,15 +1,6 @@
-import torch
-import numpy as np
-from PIL import Image
 import json
-import os
 
 class ImageCoordinatePickerNode:
-    def __init__(self):
-        self.output_dir = "coordinate_picker"
-        if not os.path.exists(self.output_dir):
-            os.makedirs(self.output_dir)
-    
     @classmethod
     def INPUT_TYPES(cls):
         return {
@@ -43,13 +34,8 @@ class ImageCoordinatePickerNode:
     CATEGORY = "image/interactive"
 
     def get_coordinates(self, image, initial_x, initial_y, point_color, point_size):
-        # 获取图像尺寸
-        if isinstance(image, torch.Tensor):
-            image_np = image.cpu().numpy()
-        else:
-            image_np = image
-            
-        height, width = image_np.shape[1:3]
+        # 获取图像尺寸 (张量和数组都直接读shape, 不需要整图转换)
+        height, width = image.shape[1:3]
         
         # 确保初始坐标在图像范围内
         x = max(0, min(initial_x, width - 1))
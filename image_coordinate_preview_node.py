@@ -1,15 +1,6 @@
-import torch
-import numpy as np
-from PIL import Image
-import json
-import os
+from . import instrumentation
 
 class ImageCoordinatePreviewNode:
-    def __init__(self):
-        self.output_dir = "coordinate_preview"
-        if not os.path.exists(self.output_dir):
-            os.makedirs(self.output_dir)
-    
     @classmethod
     def INPUT_TYPES(cls):
         return {
@@ -17,69 +8,45 @@ class ImageCoordinatePreviewNode:
                 "image": ("IMAGE",),
                 "coordinates_json": ("STRING",),
             },
+            "optional": {
+                "antialias": ("BOOLEAN", {
+                    "default": False,
+                    "label_on": "是",
+                    "label_off": "否"
+                }),
+                "profile": ("BOOLEAN", {
+                    "default": False,
+                    "label_on": "是",
+                    "label_off": "否"
+                }),
+            },
         }
 
-    RETURN_TYPES = ("IMAGE",)
+    RETURN_TYPES = ("IMAGE", "STRING")
+    RETURN_NAMES = ("image", "profile")
     FUNCTION = "preview_coordinates"
     CATEGORY = "image/preview"
 
-    def draw_point(self, image, x, y, color, size):
-        # 将numpy数组转换为PIL图像
-        if isinstance(image, torch.Tensor):
-            image_np = image.cpu().numpy()
-        else:
-            image_np = image
-            
-        pil_image = Image.fromarray((image_np[0] * 255).astype(np.uint8))
-        
-        # 确保图像是RGB模式
-        if pil_image.mode != 'RGB':
-            pil_image = pil_image.convert('RGB')
-        
-        # 创建可绘制的图像副本
-        draw_image = pil_image.copy()
-        
-        # 定义颜色映射
-        color_map = {
-            "red": (255, 0, 0),
-            "blue": (0, 0, 255),
-            "green": (0, 255, 0),
-            "yellow": (255, 255, 0),
-            "white": (255, 255, 255)
-        }
-        
-        # 获取选择的颜色
-        point_color = color_map.get(color, (255, 0, 0))
-        
-        # 绘制点
-        for i in range(-size, size + 1):
-            for j in range(-size, size + 1):
-                if i*i + j*j <= size*size:  # 圆形点
-                    px = x + i
-                    py = y + j
-                    if 0 <= px < draw_image.width and 0 <= py < draw_image.height:
-                        draw_image.putpixel((px, py), point_color)
-        
-        # 转换回numpy数组
-        result = np.array(draw_image)
-        result = result.astype(np.float32) / 255.0
-        result = np.expand_dims(result, 0)
-        
-        return result
+    def draw_point(self, image, x, y, color, size, antialias=False):
+        # 通过模板切片绘制圆形点, 整批图像一次完成
+        from . import point_markers
+        return point_markers.draw_points(image, [(x, y)], color, size, antialias)
+
+    def preview_coordinates(self, image, coordinates_json, antialias=False, profile=False):
+        from . import coordinates, point_markers
+        with instrumentation.profile_call("ImageCoordinatePreviewNode", profile) as call:
+            try:
+                # 解析坐标JSON, 同时支持单个点 {"x":..} 和点列表 [{"x":..}, ...]
+                with instrumentation.stage("parse_coordinates"):
+                    points = coordinates.parse_coordinates(coordinates_json)
+                    point_color = points.meta.get("point_color", "red")
+                    point_size = points.meta.get("point_size", 10)
+
+                # 绘制预览图像
+                with instrumentation.stage("draw"):
+                    preview_image = point_markers.draw_points(image, points.xy, point_color, point_size, antialias)
+            except Exception as e:
+                print(f"Error in preview_coordinates: {str(e)}")
+                preview_image = image
 
-    def preview_coordinates(self, image, coordinates_json):
-        try:
-            # 解析坐标JSON
-            coordinates = json.loads(coordinates_json)
-            x = coordinates.get("x", 0)
-            y = coordinates.get("y", 0)
-            point_color = coordinates.get("point_color", "red")
-            point_size = coordinates.get("point_size", 10)
-            
-            # 绘制预览图像
-            preview_image = self.draw_point(image, x, y, point_color, point_size)
-            
-            return (preview_image,)
-        except Exception as e:
-            print(f"Error in preview_coordinates: {str(e)}")
-            return (image,) 
\ No newline at end of file
+        return (preview_image, instrumentation.profile_json(call))
\ No newline at end of file
@@ -1,15 +1,8 @@
-import torch
-import numpy as np
-from PIL import Image
 import json
-import os
 
 class ImageInteractivePickerNode:
     def __init__(self):
-        self.output_dir = "interactive_picker"
-        if not os.path.exists(self.output_dir):
-            os.makedirs(self.output_dir)
-        self.last_image = None
+        # 在ComfyUI之外调用 (没有节点id) 时, 坐标保存在实例上
         self.last_coordinates = {"x": 0, "y": 0}
     
     @classmethod
@@ -25,6 +18,28 @@ class ImageInteractivePickerNode:
                     "step": 1
                 }),
             },
+            "optional": {
+                "antialias": ("BOOLEAN", {
+                    "default": False,
+                    "label_on": "是",
+                    "label_off": "否"
+                }),
+                "x": ("INT", {
+                    "default": -1,
+                    "min": -1,
+                    "max": 16384,
+                    "step": 1
+                }),
+                "y": ("INT", {
+                    "default": -1,
+                    "min": -1,
+                    "max": 16384,
+                    "step": 1
+                }),
+            },
+            "hidden": {
+                "unique_id": "UNIQUE_ID",
+            },
         }
 
     RETURN_TYPES = ("IMAGE", "INT", "INT", "STRING")
@@ -32,70 +47,33 @@ class ImageInteractivePickerNode:
     FUNCTION = "interactive_pick"
     CATEGORY = "image/interactive"
 
-    def draw_point(self, image, x, y, color, size):
-        if isinstance(image, torch.Tensor):
-            image_np = image.cpu().numpy()
-        else:
-            image_np = image
-            
-        # 转换为PIL图像
-        pil_image = Image.fromarray((image_np[0] * 255).astype(np.uint8))
-        
-        # 确保图像是RGB模式
-        if pil_image.mode != 'RGB':
-            pil_image = pil_image.convert('RGB')
-        
-        # 创建可绘制的图像副本
-        draw_image = pil_image.copy()
-        
-        # 定义颜色映射
-        color_map = {
-            "red": (255, 0, 0),
-            "blue": (0, 0, 255),
-            "green": (0, 255, 0),
-            "yellow": (255, 255, 0),
-            "white": (255, 255, 255)
-        }
-        
-        # 获取选择的颜色
-        point_color = color_map.get(color, (255, 0, 0))
-        
-        # 绘制点
-        for i in range(-size, size + 1):
-            for j in range(-size, size + 1):
-                if i*i + j*j <= size*size:  # 圆形点
-                    px = x + i
-                    py = y + j
-                    if 0 <= px < draw_image.width and 0 <= py < draw_image.height:
-                        draw_image.putpixel((px, py), point_color)
-        
-        # 转换回numpy数组
-        result = np.array(draw_image)
-        result = result.astype(np.float32) / 255.0
-        result = np.expand_dims(result, 0)
-        
-        return result
+    def draw_point(self, image, x, y, color, size, antialias=False):
+        # 通过模板切片绘制圆形点, 整批图像一次完成
+        from . import point_markers
+        return point_markers.draw_points(image, [(x, y)], color, size, antialias)
+
+    def interactive_pick(self, image, point_color, point_size, antialias=False, x=-1, y=-1, unique_id=None):
+        # 坐标按节点id保存在会话状态中 (见 picker_state.py), 服务重启后恢复; x/y 为 -1 时沿用保存的坐标
+        from . import picker_state
 
-    def interactive_pick(self, image, point_color, point_size):
-        # 获取图像尺寸
-        if isinstance(image, torch.Tensor):
-            image_np = image.cpu().numpy()
+        # 获取图像尺寸 (张量和数组都直接读shape, 不需要整图转换)
+        height, width = image.shape[1:3]
+
+        # 使用保存的坐标或默认值
+        if unique_id is not None:
+            state = picker_state.STORE.get(unique_id, self.last_coordinates)
         else:
-            image_np = image
-            
-        height, width = image_np.shape[1:3]
-        
-        # 使用上次的坐标或默认值
-        x = self.last_coordinates.get("x", width // 2)
-        y = self.last_coordinates.get("y", height // 2)
-        
+            state = self.last_coordinates
+        x = x if x >= 0 else state.get("x", width // 2)
+        y = y if y >= 0 else state.get("y", height // 2)
+
         # 确保坐标在图像范围内
         x = max(0, min(x, width - 1))
         y = max(0, min(y, height - 1))
-        
-        # 绘制带有坐标点的图像
-        preview_image = self.draw_point(image, x, y, point_color, point_size)
-        
+
+        # 绘制带有坐标点的图像 (整图只复制一次, 标记只混合到其所在的小块区域)
+        preview_image = self.draw_point(image, x, y, point_color, point_size, antialias)
+
         # 更新坐标
         self.last_coordinates = {
             "x": x,
@@ -103,15 +81,27 @@ class ImageInteractivePickerNode:
             "width": width,
             "height": height
         }
-        
+        if unique_id is not None:
+            picker_state.STORE.set(unique_id, self.last_coordinates)
+
         # 创建坐标JSON
         coordinates_json = json.dumps(self.last_coordinates)
-        
+
         return (preview_image, x, y, coordinates_json)
 
     @classmethod
     def IS_CHANGED(cls, **kwargs):
-        return float("NaN")  # 使节点始终更新
+        # 输入不变时返回相同指纹, 让ComfyUI复用缓存结果
+        # 只有 x/y 为 -1 (沿用保存的坐标) 时才把保存的值计入指纹, 且只计执行时实际读取的值:
+        # 执行会重写保存的状态, 把整个状态计入会让每次修改坐标后都多执行一次
+        from . import fingerprint, picker_state
+        unique_id = kwargs.get("unique_id")
+        x, y = kwargs.get("x", -1), kwargs.get("y", -1)
+        stored = None
+        if unique_id is not None and (x < 0 or y < 0):
+            state = picker_state.STORE.get(unique_id, {"x": 0, "y": 0})
+            stored = (state.get("x") if x < 0 else None, state.get("y") if y < 0 else None)
+        return fingerprint.inputs_fingerprint(picker_state=stored, **kwargs)
 
     @classmethod
     def VALIDATE_INPUTS(cls, **kwargs):
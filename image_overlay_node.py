@@ -1,15 +1,9 @@
-import torch
-import numpy as np
-from PIL import Image
-import json
-import os
+from . import instrumentation, options
+
+# 低精度输出且未指定chunk_size时每块的最大帧数: float32工作缓冲只按块分配, 整批输出才能真正省下一半内存
+PRECISION_CHUNK_FRAMES = 2
 
 class ImageOverlayNode:
-    def __init__(self):
-        self.output_dir = "output"
-        if not os.path.exists(self.output_dir):
-            os.makedirs(self.output_dir)
-    
     @classmethod
     def INPUT_TYPES(cls):
         return {
@@ -42,7 +36,7 @@ class ImageOverlayNode:
                     "label_on": "是",
                     "label_off": "否"
                 }),
-                "blend_mode": (["normal", "multiply", "screen", "overlay", "soft_light", "hard_light", "color_dodge", "color_burn", "darken", "lighten"],),
+                "blend_mode": (options.BLEND_MODES,),
                 "opacity": ("FLOAT", {
                     "default": 1.0,
                     "min": 0.0,
@@ -51,171 +45,209 @@ class ImageOverlayNode:
                 }),
                 "output_format": (["png", "jpg", "webp"],),
             },
+            "optional": {
+                "backend": (["tensor", "pil"],),
+                "blend_path": (options.BLEND_PATHS,),
+                "placement": (["first", "all"],),
+                "chunk_size": ("INT", {
+                    "default": 0,
+                    "min": 0,
+                    "max": 4096,
+                    "step": 1
+                }),
+                "memory_budget_mb": ("INT", {
+                    "default": 0,
+                    "min": 0,
+                    "max": 65536,
+                    "step": 64
+                }),
+                "workers": ("INT", {
+                    "default": 0,
+                    "min": 0,
+                    "max": 256,
+                    "step": 1
+                }),
+                "mask_mode": (["coverage", "union", "replace"],),
+                "invert_mask": ("BOOLEAN", {
+                    "default": False,
+                    "label_on": "是",
+                    "label_off": "否"
+                }),
+                "mask_feather": ("INT", {
+                    "default": 0,
+                    "min": 0,
+                    "max": 256,
+                    "step": 1
+                }),
+                "alpha_mode": (["straight", "premultiplied"],),
+                "resample": (options.RESAMPLE_FILTERS,),
+                "final": ("BOOLEAN", {
+                    "default": True,
+                    "label_on": "是",
+                    "label_off": "否"
+                }),
+                "proxy_fraction": ("FLOAT", {
+                    "default": 0.25,
+                    "min": 0.05,
+                    "max": 1.0,
+                    "step": 0.05
+                }),
+                "profile": ("BOOLEAN", {
+                    "default": False,
+                    "label_on": "是",
+                    "label_off": "否"
+                }),
+                "precision": (options.PRECISIONS,),
+                "reuse_output": ("BOOLEAN", {
+                    "default": False,
+                    "label_on": "是",
+                    "label_off": "否"
+                }),
+            },
         }
 
-    RETURN_TYPES = ("IMAGE", "MASK")
-    RETURN_NAMES = ("image", "mask")
+    RETURN_TYPES = ("IMAGE", "MASK", "STRING")
+    RETURN_NAMES = ("image", "mask", "profile")
     FUNCTION = "overlay_images"
     CATEGORY = "image"
 
     def apply_blend_mode(self, base, overlay, mode):
-        if mode == "normal":
-            return overlay
-        elif mode == "multiply":
-            return base * overlay
-        elif mode == "screen":
-            return 1 - (1 - base) * (1 - overlay)
-        elif mode == "overlay":
-            mask = base > 0.5
-            result = np.zeros_like(base)
-            result[mask] = 1 - 2 * (1 - base[mask]) * (1 - overlay[mask])
-            result[~mask] = 2 * base[~mask] * overlay[~mask]
-            return result
-        elif mode == "soft_light":
-            mask = overlay > 0.5
-            result = np.zeros_like(base)
-            result[mask] = base[mask] * (1 - (1 - base[mask]) * (1 - (overlay[mask] - 0.5) * 2))
-            result[~mask] = base[~mask] * (1 + (2 * overlay[~mask] - 1) * base[~mask])
-            return result
-        elif mode == "hard_light":
-            mask = overlay > 0.5
-            result = np.zeros_like(base)
-            result[mask] = 1 - 2 * (1 - base[mask]) * (1 - overlay[mask])
-            result[~mask] = 2 * base[~mask] * overlay[~mask]
-            return result
-        elif mode == "color_dodge":
-            return np.minimum(1, base / (1 - overlay + 1e-6))
-        elif mode == "color_burn":
-            return 1 - np.minimum(1, (1 - base) / (overlay + 1e-6))
-        elif mode == "darken":
-            return np.minimum(base, overlay)
-        elif mode == "lighten":
-            return np.maximum(base, overlay)
-        return overlay
-
-    def overlay_images(self, base_image, overlay_image, coordinates, scale, rotation, flip_horizontal, flip_vertical, blend_mode, opacity, output_format):
-        # 解析坐标JSON
-        try:
-            coords = json.loads(coordinates)
-            if isinstance(coords, list) and len(coords) > 0:
-                position_x = coords[0].get("x", 0)
-                position_y = coords[0].get("y", 0)
+        from . import blend_modes
+        return blend_modes.blend(base, overlay, mode)
+
+    def build_placements(self, coordinates, placement, scale, rotation, flip_horizontal, flip_vertical, opacity):
+        # 解析坐标 (单个点或点列表, 见 coordinates.py); "first"只用第一个点, "all"在每个点放置修改图
+        # 每个点可以用 scale/rotation/opacity 键覆盖节点参数; 格式错误时抛出 ValueError
+        from . import coordinates as coordinates_model
+        points = coordinates_model.parse_coordinates(coordinates)
+        count = len(points) if placement == "all" else 1
+
+        placements = []
+        for i, (x, y) in enumerate(points.xy[:count].tolist()):
+            placements.append({
+                "x": x,
+                "y": y,
+                "scale": points.override("scale", i, scale),
+                "rotation": points.override("rotation", i, rotation),
+                "flip_horizontal": flip_horizontal,
+                "flip_vertical": flip_vertical,
+                "opacity": points.override("opacity", i, opacity),
+            })
+        return placements
+
+    def stream_chunk_size(self, height, width, batch, chunk_size, memory_budget_mb, workers=1, precision="float32"):
+        # chunk_size为0表示按线程数均分整批 (低精度输出时每块不超过PRECISION_CHUNK_FRAMES帧); memory_budget_mb为0表示不限制工作内存
+        chunk = chunk_size if chunk_size > 0 else -(-batch // workers)
+        if chunk_size <= 0 and precision != "float32":
+            chunk = min(chunk, PRECISION_CHUNK_FRAMES)
+        if memory_budget_mb > 0:
+            # 每帧工作内存估算: float32 RGBA画布 + float32遮罩 + uint8 RGBA (PIL路径), 预算由并行的块分摊
+            frame_bytes = height * width * (4 * 4 + 4 + 4)
+            chunk = min(chunk, max(1, memory_budget_mb * 1024 * 1024 // (frame_bytes * workers)))
+        return max(1, min(chunk, batch))
+
+    def composite_chunk(self, image_out, mask_out, base_image, overlay_image, placements, blend_mode, backend, workers=1, mask_mode="coverage", invert_mask=False, mask_feather=0, mip=False, alpha_mode="straight", resample="legacy", blend_path="float", reuse_output=False):
+        # 合成一段帧并写入预分配输出的对应切片, 遮罩在合成时直接写入mask_out
+        # 输出不是float32时先在块大小的float32工作缓冲中合成, 最后一次转换写入输出切片
+        # 工作缓冲只在reuse_output时从缓冲池取 (按线程复用), 否则随本块结束释放
+        import torch
+        from . import overlay_engine, pil_backend
+        from .buffer_pool import BUFFER_POOL
+        final_image, final_mask = image_out, mask_out
+        if image_out.dtype != torch.float32:
+            if reuse_output:
+                image_out = BUFFER_POOL.scratch("image", final_image.shape, final_image.device)
+                mask_out = BUFFER_POOL.scratch("mask", final_mask.shape, final_mask.device)
             else:
-                position_x = 0
-                position_y = 0
-        except:
-            position_x = 0
-            position_y = 0
-
-        # 确保输入是numpy数组
-        if isinstance(base_image, torch.Tensor):
-            base_image = base_image.cpu().numpy()
-        if isinstance(overlay_image, torch.Tensor):
-            overlay_image = overlay_image.cpu().numpy()
-
-        # 转换为PIL图像
-        base_pil = Image.fromarray((base_image[0] * 255).astype(np.uint8))
-        overlay_pil = Image.fromarray((overlay_image[0] * 255).astype(np.uint8))
-
-        # 调整修改图大小
-        new_size = (int(overlay_pil.width * scale), int(overlay_pil.height * scale))
-        overlay_pil = overlay_pil.resize(new_size, Image.Resampling.LANCZOS)
-
-        # 应用翻转
-        if flip_horizontal:
-            overlay_pil = overlay_pil.transpose(Image.FLIP_LEFT_RIGHT)
-        if flip_vertical:
-            overlay_pil = overlay_pil.transpose(Image.FLIP_TOP_BOTTOM)
-
-        # 旋转修改图
-        if rotation != 0:
-            overlay_pil = overlay_pil.rotate(rotation, expand=True, resample=Image.Resampling.BICUBIC)
-            rotated_width, rotated_height = overlay_pil.size
-            if rotation % 180 != 0:
-                position_x = position_x - (rotated_width - new_size[0]) // 2
-                position_y = position_y - (rotated_height - new_size[1]) // 2
-
-        # 将底图转换为RGBA
-        if base_pil.mode != 'RGBA':
-            base_pil = base_pil.convert('RGBA')
-        
-        # 将修改图转换为RGBA
-        if overlay_pil.mode != 'RGBA':
-            overlay_pil = overlay_pil.convert('RGBA')
-
-        # 应用不透明度
-        if opacity < 1.0:
-            overlay_pil.putalpha(int(255 * opacity))
-
-        # 计算位置
-        x = position_x
-        y = position_y
-
-        # 创建新的透明图层
-        result = base_pil.copy()  # 使用底图的副本作为基础
-
-        # 粘贴修改图
-        result.paste(overlay_pil, (x, y), overlay_pil)
-        
-        # 应用混合模式
-        if blend_mode != "normal":
-            base_np = np.array(base_pil).astype(np.float32) / 255.0
-            overlay_np = np.array(overlay_pil).astype(np.float32) / 255.0
-            overlay_resized = np.zeros_like(base_np)
-            
-            h, w = overlay_np.shape[:2]
-            bh, bw = base_np.shape[:2]
-            
-            x = max(0, min(x, bw - 1))
-            y = max(0, min(y, bh - 1))
-            
-            end_x = min(x + w, bw)
-            end_y = min(y + h, bh)
-            
-            usable_w = end_x - x
-            usable_h = end_y - y
-            
-            overlay_resized[y:end_y, x:end_x] = overlay_np[:usable_h, :usable_w]
-            
-            blended = self.apply_blend_mode(base_np, overlay_resized, blend_mode)
-            result = Image.fromarray((blended * 255).astype(np.uint8))
-
-        # 创建遮罩蒙版
-        mask = Image.new('L', base_pil.size, 0)
-        if overlay_pil.mode == 'RGBA':
-            # 使用alpha通道作为蒙版
-            alpha = overlay_pil.split()[3]
-            mask.paste(alpha, (x, y))
-        else:
-            # 如果没有alpha通道，使用图像亮度作为蒙版
-            gray = overlay_pil.convert('L')
-            mask.paste(gray, (x, y))
-
-        # 根据输出格式保存
-        if output_format == "jpg":
-            result = result.convert('RGB')
-        elif output_format == "webp":
-            result = result.convert('RGBA')
-
-        # 转换回numpy数组
-        result_np = np.array(result)
-        if output_format == "jpg":
-            result_np = result_np.astype(np.float32) / 255.0
+                image_out = torch.empty(final_image.shape, dtype=torch.float32, device=final_image.device)
+                mask_out = torch.empty(final_mask.shape, dtype=torch.float32, device=final_mask.device)
+        if backend == "tensor":
+            if image_out.shape[-1] == 4:
+                overlay_engine.composite(base_image, overlay_image, placements, blend_mode, out=image_out, mask_out=mask_out, mask_mode=mask_mode, mip=mip, alpha_mode=alpha_mode, resample=resample)
+            else:
+                result, _ = overlay_engine.composite(base_image, overlay_image, placements, blend_mode, mask_out=mask_out, mask_mode=mask_mode, mip=mip, alpha_mode=alpha_mode, resample=resample)
+                image_out.copy_(result[..., :3])
         else:
-            result_np = result_np.astype(np.float32) / 255.0
-
-        # 添加批次维度
-        result_np = np.expand_dims(result_np, 0)
-
-        # 转换蒙版为numpy数组
-        mask_np = np.array(mask).astype(np.float32) / 255.0
-        mask_np = np.expand_dims(mask_np, 0)
-
-        return (torch.from_numpy(result_np), torch.from_numpy(mask_np))
+            result_u8, _ = pil_backend.composite(base_image, overlay_image, placements, blend_mode, workers, mask_out=mask_out.numpy(), mask_mode=mask_mode, resample=resample, blend_path=blend_path)
+            with instrumentation.stage("to_float"):
+                image_out.copy_(torch.from_numpy(result_u8[..., :image_out.shape[-1]])).div_(255.0)
+
+        overlay_engine.finish_mask(mask_out, invert_mask, mask_feather)
+        if image_out is not final_image:
+            with instrumentation.stage("to_precision"):
+                final_image.copy_(image_out)
+                final_mask.copy_(mask_out)
+
+    def overlay_images(self, base_image, overlay_image, coordinates, scale, rotation, flip_horizontal, flip_vertical, blend_mode, opacity, output_format, backend="tensor", blend_path="float", placement="first", chunk_size=0, memory_budget_mb=0, workers=0, mask_mode="coverage", invert_mask=False, mask_feather=0, alpha_mode="straight", resample="legacy", final=True, proxy_fraction=0.25, profile=False, precision="float32", reuse_output=False):
+        # profile为真 (或设置了HBH_OVERLAY_PROFILE) 时记录各阶段耗时, 通过第三个输出返回JSON
+        # final为假时按proxy_fraction的分辨率快速渲染代理图 (坐标和缩放按比例换算), 调整位置时使用
+        # precision 选择输出张量类型; reuse_output为真时输出写入本节点复用的缓冲池 (见 buffer_pool.py),
+        # 下一次执行会覆盖上一次的输出, 只在下游不长期持有旧结果时开启
+        import torch
+        from . import buffer_pool, overlay_engine, parallel
+        with instrumentation.profile_call("ImageOverlayNode", profile) as call:
+            with instrumentation.stage("parse_coordinates"):
+                placements = self.build_placements(coordinates, placement, scale, rotation, flip_horizontal, flip_vertical, opacity)
+
+            if base_image.dim() == 3:
+                base_image = base_image.unsqueeze(0)
+            if overlay_image.dim() == 3:
+                overlay_image = overlay_image.unsqueeze(0)
+            base_batch, overlay_batch = base_image.shape[0], overlay_image.shape[0]
+            if base_batch != overlay_batch and 1 not in (base_batch, overlay_batch):
+                raise ValueError(f"批次大小不匹配: base_image={base_batch}, overlay_image={overlay_batch}")
+            batch = max(base_batch, overlay_batch)
+
+            factor = 1.0 if final else min(max(float(proxy_fraction), 0.01), 1.0)
+            if factor < 1.0:
+                base_image = overlay_engine.proxy_base(base_image, factor)
+                placements = overlay_engine.proxy_placements(placements, factor)
+                mask_feather = int(round(mask_feather * factor))
+            height, width = base_image.shape[1:3]
+
+            # 输出一次性预分配, 按块流式合成, 工作内存只与块大小有关
+            channels = 3 if output_format == "jpg" else 4
+            device = base_image.device if backend == "tensor" else torch.device("cpu")
+            dtype = buffer_pool.dtype_for(precision)
+            with instrumentation.stage("allocate_output", batch * height * width * (channels + 1) * dtype.itemsize):
+                result = mask = None
+                if reuse_output:
+                    result = buffer_pool.BUFFER_POOL.acquire(("image", id(self)), (batch, height, width, channels), dtype, device)
+                    mask = buffer_pool.BUFFER_POOL.acquire(("mask", id(self)), (batch, height, width), dtype, device)
+                    # 输入就是上一次的输出 (节点串联或回环) 时不能原地覆盖, 改为新分配
+                    inputs = (base_image, overlay_image)
+                    if any(buffer_pool.shares_memory(buffer, tensor) for buffer in (result, mask) for tensor in inputs):
+                        result = mask = None
+                if result is None:
+                    result = torch.empty((batch, height, width, channels), dtype=dtype, device=device)
+                    mask = torch.empty((batch, height, width), dtype=dtype, device=device)
+
+            # GPU上的张量运算不需要主机线程并行
+            workers = parallel.resolve_workers(workers) if device.type == "cpu" else 1
+            chunk = self.stream_chunk_size(height, width, batch, chunk_size, memory_budget_mb, workers, precision)
+            ranges = [(start, min(start + chunk, batch)) for start in range(0, batch, chunk)]
+            # 多个块并行时块内不再拆分; 只有一个块时在块内按帧/横向分块并行
+            inner_workers = workers if len(ranges) == 1 else 1
+
+            def run_chunk(bounds):
+                start, stop = bounds
+                base_chunk = base_image[start:stop] if base_batch > 1 else base_image
+                overlay_chunk = overlay_image[start:stop] if overlay_batch > 1 else overlay_image
+                self.composite_chunk(result[start:stop], mask[start:stop], base_chunk, overlay_chunk, placements, blend_mode, backend, inner_workers, mask_mode, invert_mask, mask_feather, factor < 1.0, alpha_mode, resample, blend_path, reuse_output)
+
+            # 共用同一修改图时先串行处理第一块, 让变换结果进入缓存后再并行
+            if overlay_batch == 1:
+                run_chunk(ranges[0])
+                ranges = ranges[1:]
+            parallel.run_parallel(run_chunk, ranges, workers)
+
+        return (result, mask, instrumentation.profile_json(call))
 
     @classmethod
     def IS_CHANGED(cls, **kwargs):
-        return float("NaN")
+        # 输入不变时返回相同指纹, 让ComfyUI复用缓存结果
+        from . import fingerprint
+        return fingerprint.inputs_fingerprint(**kwargs)
 
     @classmethod
     def VALIDATE_INPUTS(cls, **kwargs):
@@ -1,14 +1,6 @@
-import torch
-import numpy as np
-from PIL import Image
-import os
+from . import instrumentation
 
 class ImageOverlayPreviewNode:
-    def __init__(self):
-        self.output_dir = "preview"
-        if not os.path.exists(self.output_dir):
-            os.makedirs(self.output_dir)
-    
     @classmethod
     def INPUT_TYPES(cls):
         return {
@@ -17,59 +9,53 @@ class ImageOverlayPreviewNode:
                 "overlay_image": ("IMAGE",),
                 "overlay_state": ("OVERLAY_STATE",),
             },
+            "optional": {
+                "proxy_size": ("INT", {
+                    "default": 0,
+                    "min": 0,
+                    "max": 8192,
+                    "step": 64
+                }),
+                "final": ("BOOLEAN", {
+                    "default": False,
+                    "label_on": "是",
+                    "label_off": "否"
+                }),
+                "profile": ("BOOLEAN", {
+                    "default": False,
+                    "label_on": "是",
+                    "label_off": "否"
+                }),
+            },
         }
 
-    RETURN_TYPES = ("IMAGE",)
+    RETURN_TYPES = ("IMAGE", "STRING", "FLOAT")
+    RETURN_NAMES = ("image", "profile", "proxy_scale")
     FUNCTION = "preview_overlay"
     CATEGORY = "image/preview"
 
-    def preview_overlay(self, base_image, overlay_image, overlay_state):
-        # 从状态中获取参数
-        position_x = overlay_state["position_x"]
-        position_y = overlay_state["position_y"]
-        scale = overlay_state["scale"]
-        rotation = overlay_state["rotation"]
-        blend_mode = overlay_state["blend_mode"]
-        opacity = overlay_state["opacity"]
-
-        # 创建临时预览图像
-        if isinstance(base_image, torch.Tensor):
-            base_image = base_image.cpu().numpy()
-        if isinstance(overlay_image, torch.Tensor):
-            overlay_image = overlay_image.cpu().numpy()
-
-        base_pil = Image.fromarray((base_image[0] * 255).astype(np.uint8))
-        overlay_pil = Image.fromarray((overlay_image[0] * 255).astype(np.uint8))
-
-        # 调整修改图大小
-        new_size = (int(overlay_pil.width * scale), int(overlay_pil.height * scale))
-        overlay_pil = overlay_pil.resize(new_size, Image.Resampling.LANCZOS)
-
-        # 旋转修改图
-        overlay_pil = overlay_pil.rotate(rotation, expand=True, resample=Image.Resampling.BICUBIC)
-
-        # 创建预览图像
-        preview = Image.new('RGBA', base_pil.size, (0, 0, 0, 0))
-        
-        # 转换图像模式
-        if base_pil.mode != 'RGBA':
-            base_pil = base_pil.convert('RGBA')
-        if overlay_pil.mode != 'RGBA':
-            overlay_pil = overlay_pil.convert('RGBA')
-
-        # 应用不透明度
-        if opacity < 1.0:
-            overlay_pil.putalpha(int(255 * opacity))
-
-        # 粘贴修改图
-        preview.paste(overlay_pil, (position_x, position_y), overlay_pil)
-        
-        # 合并图层
-        preview = Image.alpha_composite(base_pil, preview)
-
-        # 转换回numpy数组
-        preview_np = np.array(preview)
-        preview_np = preview_np.astype(np.float32) / 255.0
-        preview_np = np.expand_dims(preview_np, 0)
-
-        return (torch.from_numpy(preview_np),) 
\ No newline at end of file
+    def preview_overlay(self, base_image, overlay_image, overlay_state, proxy_size=0, final=False, profile=False):
+        # 与 ImageOverlayNode 使用同一个合成引擎 (含混合模式和翻转), 预览与最终输出一致
+        # proxy_size>0 时 (默认0, 全分辨率) 在长边不超过proxy_size的代理分辨率上变换和混合, proxy_scale 用于把坐标映射回原图
+        # final为真时忽略proxy_size, 按全分辨率渲染
+        from . import overlay_engine
+        with instrumentation.profile_call("ImageOverlayPreviewNode", profile) as call:
+            # 从状态中获取参数
+            placement = {
+                "x": overlay_state["position_x"],
+                "y": overlay_state["position_y"],
+                "scale": overlay_state["scale"],
+                "rotation": overlay_state["rotation"],
+                "flip_horizontal": overlay_state.get("flip_horizontal", False),
+                "flip_vertical": overlay_state.get("flip_vertical", False),
+                "opacity": overlay_state["opacity"],
+            }
+            blend_mode = overlay_state.get("blend_mode", "normal")
+            alpha_mode = overlay_state.get("alpha_mode", "straight")
+            resample = overlay_state.get("resample", "legacy")
+
+            height, width = base_image.shape[-3:-1]
+            factor = 1.0 if final else overlay_engine.proxy_factor(height, width, proxy_size)
+            preview, _ = overlay_engine.render(base_image[:1], overlay_image[:1], [placement], blend_mode, factor, alpha_mode=alpha_mode, resample=resample)
+
+        return (preview, instrumentation.profile_json(call), factor)
@@ -1,7 +1,3 @@
-import torch
-import numpy as np
-from PIL import Image
-
 class ImagePreviewNode:
     @classmethod
     def INPUT_TYPES(cls):
@@ -21,4 +17,6 @@ class ImagePreviewNode:
 
     @classmethod
     def IS_CHANGED(cls, **kwargs):
-        return float("NaN") 
\ No newline at end of file
+        # 输入不变时返回相同指纹, 让ComfyUI复用缓存结果
+        from . import fingerprint
+        return fingerprint.inputs_fingerprint(**kwargs) 
\ No newline at end of file
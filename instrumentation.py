@@ -0,0 +1,144 @@
+import contextlib
+import contextvars
+import json
+import math
+import os
+import threading
+import time
+
+# 可选的分阶段计时/分配统计, 默认关闭
+# 打开方式: 节点的 profile 输入, 或环境变量 HBH_OVERLAY_PROFILE=1 (=log 时每次调用打印摘要)
+# HBH_OVERLAY_PROFILE_FILE 指定路径时, 每次调用后把累计直方图写成JSON
+
+PROFILE_ENV = "HBH_OVERLAY_PROFILE"
+PROFILE_FILE_ENV = "HBH_OVERLAY_PROFILE_FILE"
+
+_current = contextvars.ContextVar("hbh_overlay_profile", default=None)
+
+
+def env_enabled():
+    return os.environ.get(PROFILE_ENV, "").strip().lower() not in ("", "0", "false", "off")
+
+
+class CallProfile:
+    # 单次节点调用的各阶段记录; 线程池中的阶段也会记到这里 (list.append 是原子操作)
+    def __init__(self, node):
+        self.node = node
+        self.records = []
+        self.started = time.perf_counter()
+        self.total = 0.0
+
+    def add(self, stage, seconds, nbytes=0):
+        self.records.append((stage, seconds, nbytes))
+
+    def summary(self):
+        stages = {}
+        for stage, seconds, nbytes in self.records:
+            entry = stages.setdefault(stage, {"count": 0, "ms": 0.0, "bytes": 0})
+            entry["count"] += 1
+            entry["ms"] += seconds * 1000
+            entry["bytes"] += nbytes
+        return {"node": self.node, "total_ms": self.total * 1000, "stages": stages}
+
+    def to_json(self):
+        return json.dumps(self.summary())
+
+
+class Histogram:
+    # 以2为底的对数分桶, 桶下界单位为微秒
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+        self.bytes = 0
+        self.buckets = {}
+
+    def add(self, seconds, nbytes=0):
+        self.count += 1
+        self.total += seconds
+        self.min = min(self.min, seconds)
+        self.max = max(self.max, seconds)
+        self.bytes += nbytes
+        bucket = 2 ** int(math.log2(max(seconds * 1e6, 1)))
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "total_ms": self.total * 1000,
+            "mean_ms": self.total * 1000 / self.count if self.count else 0.0,
+            "min_ms": self.min * 1000 if self.count else 0.0,
+            "max_ms": self.max * 1000,
+            "bytes": self.bytes,
+            "histogram_us": {str(k): v for k, v in sorted(self.buckets.items())},
+        }
+
+
+class ProfileRegistry:
+    # 进程内累计的 (节点, 阶段) 直方图
+    def __init__(self):
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def add(self, profile):
+        with self.lock:
+            self.histograms.setdefault((profile.node, "total"), Histogram()).add(profile.total)
+            for stage, seconds, nbytes in profile.records:
+                self.histograms.setdefault((profile.node, stage), Histogram()).add(seconds, nbytes)
+
+    def to_dict(self):
+        with self.lock:
+            result = {}
+            for (node, stage), histogram in sorted(self.histograms.items()):
+                result.setdefault(node, {})[stage] = histogram.to_dict()
+            return result
+
+    def dump_json(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    def clear(self):
+        with self.lock:
+            self.histograms.clear()
+
+
+REGISTRY = ProfileRegistry()
+
+
+@contextlib.contextmanager
+def profile_call(node, enabled=False):
+    # 包住一次节点调用; 未启用时产出None, 内部的 stage() 都是空操作
+    if not (enabled or env_enabled()):
+        yield None
+        return
+    profile = CallProfile(node)
+    token = _current.set(profile)
+    try:
+        yield profile
+    finally:
+        _current.reset(token)
+        profile.total = time.perf_counter() - profile.started
+        REGISTRY.add(profile)
+        if os.environ.get(PROFILE_ENV, "").strip().lower() == "log":
+            print(f"[HBH profile] {profile.to_json()}")
+        path = os.environ.get(PROFILE_FILE_ENV)
+        if path:
+            REGISTRY.dump_json(path)
+
+
+@contextlib.contextmanager
+def stage(name, nbytes=0):
+    profile = _current.get()
+    if profile is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        profile.add(name, time.perf_counter() - start, nbytes)
+
+
+def profile_json(profile):
+    return profile.to_json() if profile is not None else ""
@@ -0,0 +1,13 @@
+# 节点选项列表, 注册节点 (INPUT_TYPES) 时就要用到, 这里只放纯Python常量, 不导入torch/numpy/PIL
+
+BLEND_MODES = ["normal", "multiply", "screen", "overlay", "soft_light", "hard_light", "color_dodge", "color_burn", "darken", "lighten"]
+
+# 单次重采样可选的滤波器; "legacy" 为原来的 缩放 -> 翻转 -> 旋转 多次重采样
+RESAMPLE_FILTERS = ["legacy", "bicubic", "bilinear", "nearest"]
+
+# PIL后端的混合路径: "float" 转float32计算, "lut" 在uint8上查表
+BLEND_PATHS = ["float", "lut"]
+
+# 输出精度: 合成始终在float32下进行, 低精度只影响输出张量 (内存减半)
+# 不提供bfloat16: numpy不支持该类型, 下游调用 .numpy() 的节点 (包括ComfyUI的SaveImage) 会报错
+PRECISIONS = ["float32", "float16"]
@@ -0,0 +1,590 @@
+import math
+import torch
+import torch.nn.functional as F
+from . import blend_modes
+from .instrumentation import stage
+from .transform_cache import TRANSFORM_CACHE, tensor_digest
+
+# 纯张量合成引擎: 全程float32, 数据保留在输入所在的设备上, 不经过PIL和uint8量化
+
+
+def to_rgba(images):
+    # 补齐alpha通道 (B, H, W, 4)
+    if images.dim() == 3:
+        images = images.unsqueeze(0)
+    channels = images.shape[-1]
+    if channels == 4:
+        return images
+    if channels == 1:
+        images = images.expand(*images.shape[:-1], 3)
+    alpha = torch.ones(images.shape[:-1] + (1,), dtype=images.dtype, device=images.device)
+    return torch.cat([images[..., :3], alpha], dim=-1)
+
+
+def rotated_size(width, height, rotation):
+    # 与PIL rotate(expand=True)一致的旋转后画布尺寸: 同样把矩阵元素舍入到15位, 取四角的 ceil(max) - floor(min)
+    # 90/180/270度PIL走转置, 尺寸正好互换
+    if rotation % 360.0 in (0.0, 180.0):
+        return max(width, 1), max(height, 1)
+    if rotation % 360.0 in (90.0, 270.0):
+        return max(height, 1), max(width, 1)
+    angle = -math.radians(rotation)
+    cos_a, sin_a = round(math.cos(angle), 15), round(math.sin(angle), 15)
+    center_x, center_y = width / 2.0, height / 2.0
+    xs, ys = [], []
+    for x, y in ((0, 0), (width, 0), (width, height), (0, height)):
+        x, y = x - center_x, y - center_y
+        xs.append(cos_a * x + sin_a * y + center_x)
+        ys.append(-sin_a * x + cos_a * y + center_y)
+    new_width = math.ceil(max(xs)) - math.floor(min(xs))
+    new_height = math.ceil(max(ys)) - math.floor(min(ys))
+    return max(new_width, 1), max(new_height, 1)
+
+
+def rotate(images, rotation, shift=None):
+    # 以图像中心逆时针旋转并扩展画布, 通过仿射网格采样实现
+    # shift为输出画布上的亚像素平移 (x, y), 用于让裁剪块的采样网格与完整画布对齐
+    batch, channels, height, width = images.shape
+    out_width, out_height = rotated_size(width, height, rotation)
+    angle = math.radians(rotation)
+    cos_a, sin_a = math.cos(angle), math.sin(angle)
+    shift_x, shift_y = shift or (0.0, 0.0)
+    # 输出归一化坐标 -> 输入归一化坐标 (逆旋转)
+    theta = torch.tensor([
+        [cos_a * out_width / width, -sin_a * out_height / width, (cos_a * shift_x - sin_a * shift_y) * 2 / width],
+        [sin_a * out_width / height, cos_a * out_height / height, (sin_a * shift_x + cos_a * shift_y) * 2 / height],
+    ], dtype=images.dtype, device=images.device)
+    grid = F.affine_grid(theta.expand(batch, 2, 3), (batch, channels, out_height, out_width), align_corners=False)
+    return F.grid_sample(images, grid, mode="bicubic", padding_mode="zeros", align_corners=False).clamp_(0.0, 1.0)
+
+
+def transform_overlay(overlay, scale, rotation, flip_horizontal, flip_vertical, opacity, premultiplied=False, size=None, shift=None):
+    # 缩放/翻转/旋转/不透明度, 返回RGBA张量 (B, h, w, 4) 和位置偏移
+    # premultiplied为真时返回预乘alpha的结果: 颜色先乘alpha再重采样, 不透明度乘到原有alpha上
+    # size (宽, 高) 直接指定缩放后的尺寸, shift 传给 rotate, 供裁剪后的变换使用
+    overlay = to_rgba(overlay.float())
+    height, width = overlay.shape[1:3]
+    new_width, new_height = size or (max(int(width * scale), 1), max(int(height * scale), 1))
+
+    images = overlay.permute(0, 3, 1, 2)
+    if premultiplied:
+        with stage("premultiply"):
+            images = torch.cat([images[:, :3] * images[:, 3:], images[:, 3:]], dim=1)
+    # 调整修改图大小
+    if (new_width, new_height) != (width, height):
+        with stage("resize"):
+            images = F.interpolate(images, size=(new_height, new_width), mode="bicubic", antialias=True, align_corners=False).clamp_(0.0, 1.0)
+
+    # 应用翻转
+    flip_dims = []
+    if flip_horizontal:
+        flip_dims.append(3)
+    if flip_vertical:
+        flip_dims.append(2)
+    if flip_dims:
+        with stage("flip"):
+            images = torch.flip(images, flip_dims)
+
+    offset_x, offset_y = 0, 0
+    # 旋转修改图
+    if rotation != 0:
+        with stage("rotate"):
+            images = rotate(images, rotation, shift)
+        rotated_height, rotated_width = images.shape[2:]
+        # 所有角度都按中心不变补偿 (原先只在 rotation % 180 != 0 时补偿)
+        offset_x = -((rotated_width - new_width) // 2)
+        offset_y = -((rotated_height - new_height) // 2)
+
+    source = overlay
+    overlay = images.permute(0, 2, 3, 1).contiguous()
+    # 没有缩放/翻转/旋转时结果与输入共用存储, 先复制再原地修改, 避免改写调用方的输入
+    if overlay.data_ptr() == source.data_ptr():
+        overlay = overlay.clone()
+
+    if premultiplied:
+        # 双三次插值的过冲可能让颜色超过alpha, 截断后保持合法的预乘值
+        torch.minimum(overlay[..., :3], overlay[..., 3:], out=overlay[..., :3])
+        if opacity < 1.0:
+            overlay.mul_(opacity)
+    # 应用不透明度 (与PIL putalpha行为一致)
+    elif opacity < 1.0:
+        overlay[..., 3] = int(255 * opacity) / 255.0
+
+    return overlay, offset_x, offset_y
+
+
+def affine_window(width, height, scale, rotation, flip_horizontal, flip_vertical, bbox=None, pad=0):
+    # 把 缩放/翻转/旋转 合成一个仿射变换, 修改图中心保持在未旋转时的中心 (new_width/2, new_height/2)
+    # 返回输出窗口 (相对放置点的 x0, y0, 宽, 高) 和 输出连续坐标 -> 源连续坐标 的系数 (a, b, c, d, e, f):
+    # 源x = a*px + b*py + c, 源y = d*px + e*py + f, 像素中心位于 +0.5
+    new_width, new_height = max(int(width * scale), 1), max(int(height * scale), 1)
+    scale_x, scale_y = new_width / width, new_height / height
+    sign_x = -1.0 if flip_horizontal else 1.0
+    sign_y = -1.0 if flip_vertical else 1.0
+    angle = math.radians(rotation)
+    cos_a, sin_a = math.cos(angle), math.sin(angle)
+
+    # 源区域 (默认整幅) 的四个角变换到输出空间, 取外接矩形为输出窗口
+    x0, y0, x1, y1 = bbox or (0, 0, width, height)
+    xs, ys = [], []
+    for corner_x, corner_y in ((x0, y0), (x1, y0), (x0, y1), (x1, y1)):
+        u = (corner_x - width / 2) * scale_x * sign_x
+        v = (corner_y - height / 2) * scale_y * sign_y
+        xs.append(round(u * cos_a + v * sin_a + new_width / 2, 6))
+        ys.append(round(-u * sin_a + v * cos_a + new_height / 2, 6))
+    left, top = math.floor(min(xs)) - pad, math.floor(min(ys)) - pad
+    out_width = max(math.ceil(max(xs)) + pad - left, 1)
+    out_height = max(math.ceil(max(ys)) + pad - top, 1)
+
+    # 逆变换: 先逆旋转, 再逆翻转, 再逆缩放
+    a, b = cos_a * sign_x / scale_x, -sin_a * sign_x / scale_x
+    d, e = sin_a * sign_y / scale_y, cos_a * sign_y / scale_y
+    u0, v0 = left - new_width / 2, top - new_height / 2
+    c = a * u0 + b * v0 + width / 2
+    f = d * u0 + e * v0 + height / 2
+    return (left, top, out_width, out_height), (a, b, c, d, e, f)
+
+
+def transform_fused(overlay, scale, rotation, flip_horizontal, flip_vertical, opacity, premultiplied=False, filter="bicubic", bbox=None):
+    # 缩放/翻转/旋转合成一个仿射矩阵, 只做一次网格采样; 返回值与 transform_overlay 相同
+    # 缩小时先用2x2平均逐级预滤波到缩放比例不小于一半, 避免单次采样的混叠
+    # bbox (alpha包围盒) 不为None时只采样其变换后的外接窗口
+    overlay = to_rgba(overlay.float())
+    height, width = overlay.shape[1:3]
+    pad = 0
+    if bbox is not None:
+        # 只采样内容附近, 外扩插值核在输出上的宽度
+        pad = math.ceil(2 * max(scale, 1.0)) + 1
+    (left, top, out_width, out_height), (a, b, c, d, e, f) = affine_window(width, height, scale, rotation, flip_horizontal, flip_vertical, bbox, pad)
+
+    images = overlay.permute(0, 3, 1, 2)
+    if premultiplied:
+        with stage("premultiply"):
+            images = torch.cat([images[:, :3] * images[:, 3:], images[:, 3:]], dim=1)
+    factor = 1
+    with stage("prefilter"):
+        while scale * factor * 2 <= 1.0 and min(images.shape[2:]) >= 2:
+            images = F.avg_pool2d(images, 2, ceil_mode=True)
+            factor *= 2
+
+    with stage("resample"):
+        # 输出像素中心 -> 源坐标 -> 预滤波层上的归一化坐标 (align_corners=False)
+        px = torch.arange(out_width, dtype=torch.float32, device=overlay.device) + 0.5
+        py = torch.arange(out_height, dtype=torch.float32, device=overlay.device) + 0.5
+        level_width, level_height = images.shape[3], images.shape[2]
+        grid_x = (a * px[None, :] + b * py[:, None] + c) * (2 / (factor * level_width)) - 1
+        grid_y = (d * px[None, :] + e * py[:, None] + f) * (2 / (factor * level_height)) - 1
+        grid = torch.stack([grid_x, grid_y], dim=-1).expand(images.shape[0], out_height, out_width, 2)
+        images = F.grid_sample(images, grid, mode=filter, padding_mode="zeros", align_corners=False).clamp_(0.0, 1.0)
+
+    overlay = images.permute(0, 2, 3, 1).contiguous()
+    if premultiplied:
+        torch.minimum(overlay[..., :3], overlay[..., 3:], out=overlay[..., :3])
+        if opacity < 1.0:
+            overlay.mul_(opacity)
+    # 应用不透明度 (与PIL putalpha行为一致)
+    elif opacity < 1.0:
+        overlay[..., 3] = int(255 * opacity) / 255.0
+
+    return overlay, left, top
+
+
+def clip_region(x, y, w, h, bw, bh):
+    # 计算修改图在底图上的可见区域, 返回(底图切片, 修改图切片), 完全不可见时返回None
+    x0, y0 = max(x, 0), max(y, 0)
+    x1, y1 = min(x + w, bw), min(y + h, bh)
+    if x0 >= x1 or y0 >= y1:
+        return None
+    return (slice(y0, y1), slice(x0, x1)), (slice(y0 - y, y1 - y), slice(x0 - x, x1 - x))
+
+
+def new_canvas(base, batch, out=None):
+    # 直接分配输出画布 (或使用传入的out) 并写入底图, 避免先补alpha再复制的两次整图分配
+    if base.dim() == 3:
+        base = base.unsqueeze(0)
+    if out is None:
+        out = torch.empty((batch,) + tuple(base.shape[1:3]) + (4,), dtype=torch.float32, device=base.device)
+    canvas = out
+    channels = base.shape[-1]
+    if channels == 1:
+        canvas[..., :3] = base
+    else:
+        canvas[..., :3] = base[..., :3]
+    if channels == 4:
+        canvas[..., 3] = base[..., 3]
+    else:
+        canvas[..., 3] = 1.0
+    return canvas
+
+
+def blend_premultiplied(base_region, overlay_region, blend_mode, opaque=False):
+    # 预乘alpha的Porter-Duff over: 混合模式只作用于颜色
+    # C' = ao(1-ab)Co + ab(1-ao)Cb + ao*ab*B(Cb, Co), a = ao + ab(1-ao); 输出画布保持非预乘
+    color = base_region[..., :3]
+    overlay_color = overlay_region[..., :3]
+    alpha = overlay_region[..., 3:4]
+    blended = None
+    if blend_mode != "normal":
+        # 混合函数需要非预乘颜色, 只有这一步做除法
+        straight = overlay_color / alpha.clamp_min(1e-6)
+        blended = blend_modes.blend(color, straight.clamp_(0.0, 1.0), blend_mode).clamp_(0.0, 1.0)
+
+    if opaque:
+        # 底图不透明 (ab=1) 时化简为 C = Cb(1-ao) + ao*B, alpha保持为1, 不需要反预乘
+        if blended is None:
+            color.mul_(1 - alpha).add_(overlay_color)
+        else:
+            color.lerp_(blended, alpha)
+        return
+
+    base_alpha = base_region[..., 3:4]
+    premul = color * base_alpha
+    premul.mul_(1 - alpha)
+    if blended is None:
+        premul.add_(overlay_color)
+    else:
+        premul.addcmul_(overlay_color, 1 - base_alpha).addcmul_(blended, alpha * base_alpha)
+    out_alpha = alpha + base_alpha * (1 - alpha)
+    color.copy_(premul.div_(out_alpha.clamp_min(1e-6)).clamp_(0.0, 1.0))
+    base_alpha.copy_(out_alpha)
+
+
+# 跳过空白分块时的分块边长, 以及启用分块的最小区域
+TILE_SIZE = 64
+TILE_MIN_PIXELS = 256 * 256
+
+
+def occupied_spans(alpha, tile=TILE_SIZE):
+    # 按分块统计alpha是否非零, 每一行分块中相邻的非空分块合并成一段, 返回区域内的 (行切片, 列切片)
+    height, width = alpha.shape[1:3]
+    occupied = F.max_pool2d(alpha.amax(dim=0)[None, None], tile, ceil_mode=True)[0, 0] > 0
+    spans = []
+    for i, row in enumerate(occupied.cpu().tolist()):
+        rows = slice(i * tile, min((i + 1) * tile, height))
+        start = None
+        for j, filled in enumerate(row + [False]):
+            if filled and start is None:
+                start = j
+            elif not filled and start is not None:
+                spans.append((rows, slice(start * tile, min(j * tile, width))))
+                start = None
+    return spans
+
+
+def paste(result, mask, overlay, x, y, blend_mode, mask_mode="coverage", premultiplied=False, opaque=False, skip_empty=False):
+    # 把变换后的修改图原地贴到输出画布, 遮罩直接由同一块裁剪后的alpha写入
+    # skip_empty为真时 (透明像素不改变输出的模式) 跳过alpha全为0的分块
+    bh, bw = result.shape[1:3]
+    h, w = overlay.shape[1:3]
+    region = clip_region(x, y, w, h, bw, bh)
+    if region is None:
+        return
+    (rows, cols), (o_rows, o_cols) = region
+
+    if skip_empty and (rows.stop - rows.start) * (cols.stop - cols.start) >= TILE_MIN_PIXELS:
+        with stage("tiles"):
+            spans = occupied_spans(overlay[:, o_rows, o_cols, 3])
+        for span_rows, span_cols in spans:
+            blend_region(result, mask, overlay,
+                         slice(rows.start + span_rows.start, rows.start + span_rows.stop), slice(cols.start + span_cols.start, cols.start + span_cols.stop),
+                         slice(o_rows.start + span_rows.start, o_rows.start + span_rows.stop), slice(o_cols.start + span_cols.start, o_cols.start + span_cols.stop),
+                         blend_mode, mask_mode, premultiplied, opaque)
+        return
+    blend_region(result, mask, overlay, rows, cols, o_rows, o_cols, blend_mode, mask_mode, premultiplied, opaque)
+
+
+def blend_region(result, mask, overlay, rows, cols, o_rows, o_cols, blend_mode, mask_mode="coverage", premultiplied=False, opaque=False):
+    overlay_region = overlay[:, o_rows, o_cols]
+    alpha = overlay_region[..., 3:4]
+
+    # 只在修改图的可见区域内计算, 结果原地写回输出画布
+    base_region = result[:, rows, cols]
+    with stage("blend"):
+        if premultiplied:
+            blend_premultiplied(base_region, overlay_region, blend_mode, opaque)
+        elif blend_mode == "normal":
+            # 以alpha为蒙版粘贴修改图
+            base_region.lerp_(overlay_region, alpha)
+        else:
+            blend_modes.blend(base_region, overlay_region, blend_mode, out=base_region)
+            base_region.clamp_(0.0, 1.0)
+
+    with stage("mask"):
+        combine_mask(mask[:, rows, cols], alpha[..., 0], mask_mode)
+
+
+def combine_mask(mask_region, alpha, mask_mode):
+    # coverage: 按覆盖率叠加 (a + m(1-a)); union: 取最大值; replace: 后放置的直接覆盖
+    if mask_mode == "union":
+        torch.maximum(mask_region, alpha, out=mask_region)
+    elif mask_mode == "replace":
+        mask_region.copy_(alpha.expand_as(mask_region))
+    else:
+        mask_region.mul_(1 - alpha).add_(alpha)
+
+
+def box_blur(images, radius, dim):
+    # 基于前缀和的盒式模糊, 每像素O(1), 边缘按复制边界处理
+    images = images.transpose(dim, -1)
+    shape = images.shape
+    flat = images.reshape(-1, 1, shape[-1])
+    padded = F.pad(flat, (radius + 1, radius), mode="replicate")
+    sums = padded.cumsum(-1)
+    blurred = (sums[..., 2 * radius + 1:] - sums[..., :-(2 * radius + 1)]) / (2 * radius + 1)
+    return blurred.reshape(shape).transpose(dim, -1)
+
+
+def feather_mask(mask, radius):
+    # 三次可分离盒式模糊近似高斯羽化, 只处理遮罩非零区域外扩radius后的范围
+    if radius <= 0:
+        return mask
+    covered = mask.amax(dim=0) > 0
+    rows = torch.nonzero(covered.any(dim=1)).flatten()
+    cols = torch.nonzero(covered.any(dim=0)).flatten()
+    if rows.numel() == 0:
+        return mask
+    height, width = mask.shape[1:3]
+    y0, y1 = max(int(rows[0]) - radius, 0), min(int(rows[-1]) + radius + 1, height)
+    x0, x1 = max(int(cols[0]) - radius, 0), min(int(cols[-1]) + radius + 1, width)
+    region = mask[:, y0:y1, x0:x1]
+    # 三次的盒半径之和正好等于radius, 模糊不会超出外扩的范围 (半径1/2时只做一/两次)
+    blurred = region
+    for i in range(3):
+        box_radius = radius // 3 + (1 if i < radius % 3 else 0)
+        if box_radius > 0:
+            blurred = box_blur(blurred, box_radius, 2)
+            blurred = box_blur(blurred, box_radius, 1)
+    region.copy_(blurred.clamp_(0.0, 1.0))
+    return mask
+
+
+def finish_mask(mask, invert=False, feather=0):
+    # 合成完成后对遮罩做羽化/反转 (原地)
+    with stage("mask_feather"):
+        feather_mask(mask, int(feather))
+    if invert:
+        with stage("mask_invert"):
+            mask.neg_().add_(1.0)
+    return mask
+
+
+def placement_key(placement):
+    return (placement["scale"], placement["rotation"], placement["flip_horizontal"], placement["flip_vertical"], placement["opacity"])
+
+
+def cached_transform(overlay, key, digest=None, level=0, sparse=False, resample="legacy"):
+    # 变换结果按内容哈希和变换参数缓存, 相同修改图和参数在多次执行间复用
+    # level>0 时从mip金字塔的对应层变换, key中的缩放是相对该层的
+    # sparse为真时先裁剪到alpha紧包围盒再变换, 修改图完全透明时返回 (None, 0, 0)
+    # resample不是"legacy"时用 transform_fused 单次重采样
+    if digest is None:
+        digest = tensor_digest(overlay)
+    cache_key = ("tensor", str(overlay.device), digest, level, key, sparse, resample)
+
+    def factory():
+        source = mip_level(overlay, level, digest)
+        if resample != "legacy":
+            bbox = None
+            if sparse:
+                bbox = alpha_bbox(source, digest, level)
+                if bbox is None:
+                    return None, 0, 0
+            return transform_fused(source, *key, filter=resample, bbox=bbox)
+        if sparse:
+            return transform_cropped(source, alpha_bbox(source, digest, level), *key)
+        return transform_overlay(source, *key)
+
+    with stage("transform"):
+        return TRANSFORM_CACHE.get_or_create(cache_key, factory)
+
+
+def alpha_bbox(overlay, digest, level=0):
+    # 整批修改图alpha非零区域的并集包围盒 (x0, y0, x1, y1), 全透明时为None; 按内容哈希缓存
+    def factory():
+        with stage("alpha_bbox"):
+            if overlay.shape[-1] != 4:
+                return (0, 0, overlay.shape[-2], overlay.shape[-3])
+            covered = (overlay[..., 3] > 0).any(dim=0)
+            rows = torch.nonzero(covered.any(dim=1)).flatten()
+            cols = torch.nonzero(covered.any(dim=0)).flatten()
+            if rows.numel() == 0:
+                return ()
+            return (int(cols[0]), int(rows[0]), int(cols[-1]) + 1, int(rows[-1]) + 1)
+
+    bbox = TRANSFORM_CACHE.get_or_create(("alpha_bbox", str(overlay.device), digest, level), factory)
+    return bbox or None
+
+
+def aligned_bounds(start, stop, size, new_size, margin):
+    # 外扩margin后把边界对齐到缩放网格 (start*new_size/size 为整数), 使裁剪块的采样位置与完整缩放完全一致
+    step = size // math.gcd(size, new_size)
+    start = max(start - margin, 0) // step * step
+    stop = min(-(-min(stop + margin, size) // step) * step, size)
+    return start, stop
+
+
+def transform_cropped(overlay, bbox, scale, rotation, flip_horizontal, flip_vertical, opacity, premultiplied=False):
+    # 只变换包围盒 (外扩重采样核的宽度) 内的部分, 再把裁剪块在完整变换结果中的位置折算进偏移
+    # 裁剪边界对齐缩放网格, 旋转的亚像素余量由 rotate 的 shift 补偿, 结果与完整变换后再裁剪一致
+    if bbox is None:
+        return None, 0, 0
+    height, width = overlay.shape[1:3]
+    new_width, new_height = max(int(width * scale), 1), max(int(height * scale), 1)
+    margin = math.ceil(2 / min(scale, 1.0)) + 1
+    x0, x1 = aligned_bounds(bbox[0], bbox[2], width, new_width, margin)
+    y0, y1 = aligned_bounds(bbox[1], bbox[3], height, new_height, margin)
+    if (x1 - x0) * (y1 - y0) >= 0.9 * width * height:
+        return transform_overlay(overlay, scale, rotation, flip_horizontal, flip_vertical, opacity, premultiplied)
+
+    # 裁剪块缩放后的尺寸和在完整缩放 (及翻转) 结果中的位置, 都是整数
+    crop_width, crop_height = (x1 - x0) * new_width // width, (y1 - y0) * new_height // height
+    left, top = x0 * new_width // width, y0 * new_height // height
+    if flip_horizontal:
+        left = new_width - left - crop_width
+    if flip_vertical:
+        top = new_height - top - crop_height
+    if rotation == 0:
+        cropped, _, _ = transform_overlay(overlay[:, y0:y1, x0:x1], scale, rotation, flip_horizontal, flip_vertical, opacity, premultiplied, (crop_width, crop_height))
+        return cropped, left, top
+
+    # 完整变换的旋转画布和原有的位置偏移
+    rotated_width, rotated_height = rotated_size(new_width, new_height, rotation)
+    offset_x = -((rotated_width - new_width) // 2)
+    offset_y = -((rotated_height - new_height) // 2)
+    # 裁剪块中心绕完整图中心逆时针旋转 (y轴向下), 得到其旋转画布在完整旋转画布中的位置
+    angle = math.radians(rotation)
+    cos_a, sin_a = math.cos(angle), math.sin(angle)
+    dx = left + crop_width / 2 - new_width / 2
+    dy = top + crop_height / 2 - new_height / 2
+    rotated_crop_width, rotated_crop_height = rotated_size(crop_width, crop_height, rotation)
+    exact_left = rotated_width / 2 + dx * cos_a + dy * sin_a - rotated_crop_width / 2
+    exact_top = rotated_height / 2 - dx * sin_a + dy * cos_a - rotated_crop_height / 2
+    left, top = math.floor(exact_left + 0.5), math.floor(exact_top + 0.5)
+    cropped, _, _ = transform_overlay(overlay[:, y0:y1, x0:x1], scale, rotation, flip_horizontal, flip_vertical, opacity, premultiplied,
+                                      (crop_width, crop_height), (left - exact_left, top - exact_top))
+    return cropped, offset_x + left, offset_y + top
+
+
+# mip层的最短边不小于这个尺寸
+MIP_MIN_SIZE = 16
+
+
+def mip_level(overlay, level, digest):
+    # 修改图的第level层 (每层长宽减半, 2x2平均), 逐层从上一层生成并缓存
+    if level == 0:
+        return overlay
+
+    def factory():
+        images = mip_level(overlay, level - 1, digest)
+        with stage("mip"):
+            images = to_rgba(images.float()).permute(0, 3, 1, 2)
+            return F.avg_pool2d(images, 2, ceil_mode=True).permute(0, 2, 3, 1).contiguous()
+
+    return TRANSFORM_CACHE.get_or_create(("mip", str(overlay.device), digest, level), factory)
+
+
+def choose_mip(overlay, scale):
+    # 缩小超过一半时改从金字塔中不小于目标尺寸的最小一层变换, 返回 (层号, 相对该层的缩放)
+    height, width = overlay.shape[-3:-1]
+    level = 0
+    while scale * (1 << (level + 1)) <= 1.0 and min(height, width) >> (level + 1) >= MIP_MIN_SIZE:
+        level += 1
+    if level == 0:
+        return 0, scale
+    # 按该层实际尺寸折算, 使变换后的尺寸与全分辨率变换一致
+    level_width = -(-width // (1 << level))
+    return level, scale * width / level_width
+
+
+def composite(base, overlay, placements, blend_mode, out=None, mask_out=None, mask_mode="coverage", mip=False, alpha_mode="straight", sparse=True, resample="legacy"):
+    # 批量合成, 批次为1的一侧广播到另一侧; 按顺序把修改图贴到每个放置点
+    # 相同变换参数的放置点共用一次变换结果; 返回 (B, H, W, 4) 图像和 (B, H, W) 遮罩
+    # 传入 out / mask_out 时直接写入这些预分配的缓冲; mip为真时小比例缩放从mip金字塔变换 (用于代理渲染)
+    # alpha_mode="premultiplied" 时使用预乘alpha合成 (Porter-Duff over), "straight" 为原有行为
+    # sparse为真且透明像素不改变输出时 (normal或预乘模式, 遮罩不是replace), 裁掉透明边框并跳过空白分块
+    # resample 选择 options.RESAMPLE_FILTERS 中的单次重采样滤波器, "legacy" 为原有的逐步变换
+    # 在改变形状/设备前对原始输入取哈希, 以便复用同一张量对象的哈希结果
+    with stage("hash"):
+        digest = tensor_digest(overlay)
+    if base.dim() == 3:
+        base = base.unsqueeze(0)
+    overlay = overlay.to(base.device)
+    if overlay.dim() == 3:
+        overlay = overlay.unsqueeze(0)
+    base_batch, overlay_batch = base.shape[0], overlay.shape[0]
+    if base_batch != overlay_batch and 1 not in (base_batch, overlay_batch):
+        raise ValueError(f"批次大小不匹配: base_image={base_batch}, overlay_image={overlay_batch}")
+    batch = max(base_batch, overlay_batch)
+
+    bh, bw = base.shape[1:3]
+    with stage("canvas", 0 if out is not None else batch * bh * bw * 4 * 4):
+        result = new_canvas(base, batch, out)
+    if mask_out is None:
+        mask = torch.zeros((batch, bh, bw), dtype=torch.float32, device=base.device)
+    else:
+        mask = mask_out.zero_()
+
+    premultiplied = alpha_mode == "premultiplied"
+    # 底图没有alpha通道时画布alpha恒为1
+    opaque = base.shape[-1] != 4
+    sparse = sparse and (premultiplied or blend_mode == "normal") and mask_mode != "replace"
+    for placement in placements:
+        key = placement_key(placement)
+        level = 0
+        if mip:
+            level, level_scale = choose_mip(overlay, key[0])
+            key = (level_scale,) + key[1:]
+        if premultiplied:
+            key = key + (True,)
+        # 非预乘模式下 opacity<1 会把整块alpha设为同一个值 (putalpha), 透明边框不再透明
+        skip = sparse and (premultiplied or placement["opacity"] >= 1.0)
+        overlay_rgba, offset_x, offset_y = cached_transform(overlay, key, digest, level, skip, resample)
+        if overlay_rgba is None:
+            continue
+        paste(result, mask, overlay_rgba, int(placement["x"]) + offset_x, int(placement["y"]) + offset_y, blend_mode, mask_mode, premultiplied, opaque, skip)
+
+    return result, mask
+
+
+def proxy_factor(height, width, proxy_size):
+    # 长边缩放到proxy_size所需的比例, 不放大; proxy_size为0表示全分辨率
+    if proxy_size <= 0 or max(height, width) <= proxy_size:
+        return 1.0
+    return proxy_size / max(height, width)
+
+
+def proxy_placements(placements, factor):
+    # 把全分辨率的放置参数映射到代理分辨率
+    if factor == 1.0:
+        return placements
+    return [
+        dict(placement, x=int(round(placement["x"] * factor)), y=int(round(placement["y"] * factor)), scale=placement["scale"] * factor)
+        for placement in placements
+    ]
+
+
+def downscale(images, factor):
+    if factor == 1.0:
+        return images
+    if images.dim() == 3:
+        images = images.unsqueeze(0)
+    height, width = images.shape[1:3]
+    size = (max(int(round(height * factor)), 1), max(int(round(width * factor)), 1))
+    with stage("proxy_downscale"):
+        scaled = F.interpolate(images.float().permute(0, 3, 1, 2), size=size, mode="bilinear", antialias=True, align_corners=False)
+    return scaled.clamp_(0.0, 1.0).permute(0, 2, 3, 1).contiguous()
+
+
+def proxy_base(base, factor):
+    # 缩小后的底图按内容哈希缓存, 只调整位置/参数时不再重复缩小整张大图
+    if factor == 1.0:
+        return base
+    with stage("hash"):
+        digest = tensor_digest(base)
+    return TRANSFORM_CACHE.get_or_create(("proxy_base", str(base.device), digest, factor), lambda: downscale(base, factor))
+
+
+def render(base, overlay, placements, blend_mode, factor=1.0, mask_mode="coverage", alpha_mode="straight", resample="legacy"):
+    # 最终渲染和预览共用的入口; factor<1时在代理分辨率上合成, 修改图的缩放一并折算并从mip金字塔变换, 只重采样一次
+    # 返回 (图像, 遮罩), 代理图上的坐标除以factor映射回全分辨率
+    return composite(proxy_base(base, factor), overlay, proxy_placements(placements, factor), blend_mode, mask_mode=mask_mode, mip=factor < 1.0, alpha_mode=alpha_mode, resample=resample)
@@ -0,0 +1,54 @@
+import contextvars
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+# 线程池并行: PIL的缩放/旋转和NumPy的大数组运算会释放GIL, 用线程即可利用多核
+
+WORKERS_ENV = "HBH_OVERLAY_WORKERS"
+
+# 单个区域至少这么多像素才拆成横向分块并行
+TILE_MIN_PIXELS = 1 << 20
+
+_executors = {}
+_lock = threading.Lock()
+
+
+def resolve_workers(workers=0):
+    # workers为0时读取环境变量, 未设置则使用全部CPU核心
+    if workers and workers > 0:
+        return int(workers)
+    value = os.environ.get(WORKERS_ENV, "")
+    if value.strip():
+        try:
+            return max(1, int(value))
+        except ValueError:
+            print(f"Invalid {WORKERS_ENV}={value!r}, using all CPU cores")
+    return os.cpu_count() or 1
+
+
+def get_executor(workers):
+    with _lock:
+        executor = _executors.get(workers)
+        if executor is None:
+            executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="hbh_overlay")
+            _executors[workers] = executor
+        return executor
+
+
+def run_parallel(fn, items, workers):
+    # 按顺序返回结果; 只有一个任务或单线程时直接在当前线程执行
+    # 每个任务在调用方上下文的副本中运行, 以便分阶段统计等上下文变量传到工作线程
+    items = list(items)
+    if workers <= 1 or len(items) <= 1:
+        return [fn(item) for item in items]
+    context = contextvars.copy_context()
+    return list(get_executor(workers).map(lambda item: context.copy().run(fn, item), items))
+
+
+def row_bands(start, stop, parts):
+    # 把 [start, stop) 行区间均分为最多parts段
+    total = stop - start
+    parts = max(1, min(parts, total))
+    bounds = [start + total * i // parts for i in range(parts + 1)]
+    return [(bounds[i], bounds[i + 1]) for i in range(parts) if bounds[i] < bounds[i + 1]]
@@ -0,0 +1,83 @@
+import json
+import os
+import threading
+
+# 交互取点节点的会话状态: 按节点id保存坐标, 写入JSON文件以便服务重启后恢复
+# 文件路径: 环境变量 HBH_PICKER_STATE_FILE; 未设置时使用ComfyUI的user目录; 都不可用时只保存在内存中
+# 路径在第一次读写时才确定, 导入和节点构造时不做文件操作
+
+STATE_FILE_ENV = "HBH_PICKER_STATE_FILE"
+STATE_FILE_NAME = "hbh_picker_state.json"
+
+
+def default_state_path():
+    path = os.environ.get(STATE_FILE_ENV)
+    if path:
+        return path
+    try:
+        import folder_paths
+        return os.path.join(folder_paths.get_user_directory(), STATE_FILE_NAME)
+    except Exception:
+        return None
+
+
+class PickerStateStore:
+    def __init__(self, path=None):
+        self.path = path
+        self.states = None
+        self.lock = threading.Lock()
+
+    def _load(self):
+        # 调用方持有锁
+        if self.states is not None:
+            return
+        self.states = {}
+        if self.path is None:
+            self.path = default_state_path()
+        if self.path and os.path.exists(self.path):
+            try:
+                with open(self.path, encoding="utf-8") as f:
+                    self.states = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Error loading picker state: {str(e)}")
+
+    def _save(self):
+        # 先写临时文件再替换, 避免写到一半的文件; 只读环境下写入失败时仅提示
+        if not self.path:
+            return
+        try:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            os.makedirs(directory, exist_ok=True)
+            temp_path = f"{self.path}.tmp"
+            with open(temp_path, "w", encoding="utf-8") as f:
+                json.dump(self.states, f)
+            os.replace(temp_path, self.path)
+        except OSError as e:
+            print(f"Error saving picker state: {str(e)}")
+
+    def get(self, node_id, default=None):
+        with self.lock:
+            self._load()
+            return dict(self.states.get(str(node_id), default or {}))
+
+    def set(self, node_id, state):
+        # 内容不变时不写文件
+        with self.lock:
+            self._load()
+            key = str(node_id)
+            if self.states.get(key) == state:
+                return
+            self.states[key] = dict(state)
+            self._save()
+
+    def clear(self, node_id=None):
+        with self.lock:
+            self._load()
+            if node_id is None:
+                self.states.clear()
+            else:
+                self.states.pop(str(node_id), None)
+            self._save()
+
+
+STORE = PickerStateStore()
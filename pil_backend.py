@@ -0,0 +1,234 @@
+import torch
+import numpy as np
+from PIL import Image
+from . import blend_modes, parallel
+from .instrumentation import stage
+from .overlay_engine import affine_window, clip_region, placement_key
+from .transform_cache import TRANSFORM_CACHE, tensor_digest
+
+# PIL后备路径: 经uint8量化, 可用于与张量路径对比输出
+
+
+def to_uint8_batch(images):
+    # 整个批次一次性转换为uint8 (B, H, W, C)
+    if isinstance(images, torch.Tensor):
+        images = images.cpu().numpy()
+    if images.ndim == 3:
+        images = images[None]
+    return (np.clip(images, 0.0, 1.0) * 255).astype(np.uint8)
+
+
+def to_rgba(images_u8):
+    # 批量补齐alpha通道
+    channels = images_u8.shape[-1]
+    if channels == 4:
+        return images_u8
+    if channels == 1:
+        images_u8 = np.repeat(images_u8, 3, axis=-1)
+    alpha = np.full(images_u8.shape[:-1] + (1,), 255, dtype=np.uint8)
+    return np.concatenate([images_u8[..., :3], alpha], axis=-1)
+
+
+def transform_overlay(overlay_u8, scale, rotation, flip_horizontal, flip_vertical, opacity):
+    # 对单帧修改图执行缩放/翻转/旋转/不透明度, 返回RGBA数组和位置偏移
+    overlay_pil = Image.fromarray(overlay_u8)
+
+    # 调整修改图大小
+    new_size = (max(int(overlay_pil.width * scale), 1), max(int(overlay_pil.height * scale), 1))
+    with stage("resize"):
+        overlay_pil = overlay_pil.resize(new_size, Image.Resampling.LANCZOS)
+
+    # 应用翻转
+    with stage("flip"):
+        if flip_horizontal:
+            overlay_pil = overlay_pil.transpose(Image.FLIP_LEFT_RIGHT)
+        if flip_vertical:
+            overlay_pil = overlay_pil.transpose(Image.FLIP_TOP_BOTTOM)
+
+    offset_x, offset_y = 0, 0
+    # 旋转修改图
+    if rotation != 0:
+        with stage("rotate"):
+            overlay_pil = overlay_pil.rotate(rotation, expand=True, resample=Image.Resampling.BICUBIC)
+        rotated_width, rotated_height = overlay_pil.size
+        # 所有角度都按中心不变补偿 (原先只在 rotation % 180 != 0 时补偿)
+        offset_x = -((rotated_width - new_size[0]) // 2)
+        offset_y = -((rotated_height - new_size[1]) // 2)
+
+    # 将修改图转换为RGBA
+    with stage("convert"):
+        if overlay_pil.mode != 'RGBA':
+            overlay_pil = overlay_pil.convert('RGBA')
+
+    # 应用不透明度
+    if opacity < 1.0:
+        with stage("opacity"):
+            overlay_pil.putalpha(int(255 * opacity))
+
+    return np.array(overlay_pil), offset_x, offset_y
+
+
+PIL_FILTERS = {
+    "bicubic": Image.Resampling.BICUBIC,
+    "bilinear": Image.Resampling.BILINEAR,
+    "nearest": Image.Resampling.NEAREST,
+}
+
+
+def transform_fused(overlay_u8, scale, rotation, flip_horizontal, flip_vertical, opacity, filter="bicubic"):
+    # 缩放/翻转/旋转合成一个仿射变换, 用 Image.transform 一次重采样; 缩小时先用 reduce 整数倍预滤波
+    overlay_pil = Image.fromarray(overlay_u8)
+    with stage("convert"):
+        if overlay_pil.mode != 'RGBA':
+            overlay_pil = overlay_pil.convert('RGBA')
+    (left, top, out_width, out_height), (a, b, c, d, e, f) = affine_window(
+        overlay_pil.width, overlay_pil.height, scale, rotation, flip_horizontal, flip_vertical)
+
+    factor = 1
+    while scale * factor * 2 <= 1.0 and min(overlay_pil.size) >= factor * 4:
+        factor *= 2
+    if factor > 1:
+        with stage("prefilter"):
+            overlay_pil = overlay_pil.reduce(factor)
+
+    with stage("resample"):
+        data = (a / factor, b / factor, c / factor, d / factor, e / factor, f / factor)
+        overlay_pil = overlay_pil.transform((out_width, out_height), Image.Transform.AFFINE, data, resample=PIL_FILTERS[filter])
+
+    # 应用不透明度
+    if opacity < 1.0:
+        with stage("opacity"):
+            overlay_pil.putalpha(int(255 * opacity))
+
+    return np.array(overlay_pil), left, top
+
+
+def cached_transform(overlay_image, key, workers=1, resample="legacy"):
+    # 整批修改图的变换结果 (B, h, w, 4) uint8, 按内容哈希和变换参数缓存
+    def transform(frame):
+        if resample != "legacy":
+            return transform_fused(frame, *key, filter=resample)
+        return transform_overlay(frame, *key)
+
+    def factory():
+        frames = parallel.run_parallel(transform, to_uint8_batch(overlay_image), workers)
+        return np.stack([f[0] for f in frames]), frames[0][1], frames[0][2]
+
+    with stage("hash"):
+        cache_key = ("pil", tensor_digest(overlay_image), key, resample)
+    with stage("transform"):
+        return TRANSFORM_CACHE.get_or_create(cache_key, factory)
+
+
+def combine_mask(mask_region, alpha, mask_mode):
+    # coverage: 按覆盖率叠加 (a + m(1-a)); union: 取最大值; replace: 后放置的直接覆盖
+    if mask_mode == "union":
+        np.maximum(mask_region, alpha, out=mask_region)
+    elif mask_mode == "replace":
+        mask_region[...] = alpha
+    else:
+        mask_region *= 1 - alpha
+        mask_region += alpha
+
+
+def blend_region_lut(base_u8, mask_np, overlay_rgba, rows, cols, o_rows, o_cols, blend_mode, mask_mode="coverage"):
+    # 8位路径: 混合模式查表, normal 用整数插值 (与浮点路径相差不超过1级), 只有遮罩用到float
+    overlay_u8 = overlay_rgba[:, o_rows, o_cols]
+    base_region = base_u8[:, rows, cols]
+    with stage("blend"):
+        if blend_mode == "normal":
+            alpha = overlay_u8[..., 3:4].astype(np.uint16)
+            mixed = base_region * (255 - alpha)
+            mixed += overlay_u8 * alpha
+            mixed += 127
+            mixed //= 255
+            base_region[...] = mixed
+        else:
+            blend_modes.blend_u8(base_region, overlay_u8, blend_mode, out=base_region)
+
+    with stage("mask"):
+        combine_mask(mask_np[:, rows, cols], overlay_u8[..., 3].astype(np.float32) / 255.0, mask_mode)
+
+
+def blend_region(base_u8, mask_np, overlay_rgba, rows, cols, o_rows, o_cols, blend_mode, mask_mode="coverage", blend_path="float"):
+    # 只在修改图的可见区域内计算, 结果原地写回输出缓冲
+    if blend_path == "lut":
+        blend_region_lut(base_u8, mask_np, overlay_rgba, rows, cols, o_rows, o_cols, blend_mode, mask_mode)
+        return
+    with stage("to_float", overlay_rgba[:, o_rows, o_cols].size * 4 * 2):
+        overlay_np = overlay_rgba[:, o_rows, o_cols].astype(np.float32) / 255.0
+        alpha = overlay_np[..., 3:4]
+        base_np = base_u8[:, rows, cols].astype(np.float32) / 255.0
+
+    with stage("blend"):
+        if blend_mode == "normal":
+            # 以alpha为蒙版整批粘贴修改图
+            blended = overlay_np * alpha + base_np * (1 - alpha)
+            base_u8[:, rows, cols] = np.round(blended * 255).astype(np.uint8)
+        else:
+            # 应用混合模式 (整批一次计算)
+            blend_modes.blend(base_np, overlay_np, blend_mode, out=base_np)
+            np.clip(base_np, 0, 1, out=base_np)
+            base_u8[:, rows, cols] = (base_np * 255).astype(np.uint8)
+
+    # 使用alpha通道作为蒙版
+    with stage("mask"):
+        combine_mask(mask_np[:, rows, cols], alpha[..., 0], mask_mode)
+
+
+def paste(base_u8, mask_np, overlay_rgba, x, y, blend_mode, workers=1, mask_mode="coverage", blend_path="float"):
+    # 把变换后的修改图原地贴到uint8输出缓冲, 遮罩直接由同一块裁剪后的alpha写入
+    bh, bw = base_u8.shape[1:3]
+    h, w = overlay_rgba.shape[1:3]
+    region = clip_region(x, y, w, h, bw, bh)
+    if region is None:
+        return
+    (rows, cols), (o_rows, o_cols) = region
+
+    pixels = base_u8.shape[0] * (rows.stop - rows.start) * (cols.stop - cols.start)
+    if workers <= 1 or pixels < parallel.TILE_MIN_PIXELS:
+        blend_region(base_u8, mask_np, overlay_rgba, rows, cols, o_rows, o_cols, blend_mode, mask_mode, blend_path)
+        return
+
+    # 大区域按横向分块并行, 各块写入互不重叠的行
+    shift = o_rows.start - rows.start
+
+    def blend_band(band):
+        start, stop = band
+        blend_region(base_u8, mask_np, overlay_rgba, slice(start, stop), cols, slice(start + shift, stop + shift), o_cols, blend_mode, mask_mode, blend_path)
+
+    parallel.run_parallel(blend_band, parallel.row_bands(rows.start, rows.stop, workers), workers)
+
+
+def composite(base_image, overlay_image, placements, blend_mode, workers=1, mask_out=None, mask_mode="coverage", resample="legacy", blend_path="float"):
+    # blend_path="lut" 时在uint8上查表混合 (见 blend_region_lut), "float" 为原来的浮点路径
+    # 整批转换, 批次为1的一侧广播到另一侧; 返回 (B, H, W, 4) uint8 图像和 (B, H, W) float32 遮罩
+    # 传入 mask_out (float32数组, 可以是预分配张量的numpy视图) 时遮罩直接写入其中
+    with stage("to_uint8"):
+        base_u8 = to_rgba(to_uint8_batch(base_image))
+    overlay_batch = overlay_image.shape[0] if overlay_image.ndim == 4 else 1
+    base_batch = base_u8.shape[0]
+    if base_batch != overlay_batch and 1 not in (base_batch, overlay_batch):
+        raise ValueError(f"批次大小不匹配: base_image={base_batch}, overlay_image={overlay_batch}")
+    batch = max(base_batch, overlay_batch)
+
+    bh, bw = base_u8.shape[1:3]
+    with stage("canvas", batch * bh * bw * (4 + 4)):
+        # to_uint8_batch 总是返回新数组, 可以直接作为输出缓冲
+        if base_batch < batch:
+            base_u8 = np.repeat(base_u8, batch, axis=0)
+        if mask_out is None:
+            mask_np = np.zeros((batch, bh, bw), dtype=np.float32)
+        else:
+            mask_np = mask_out
+            mask_np.fill(0)
+
+    for placement in placements:
+        # 修改图按帧变换, 相同变换参数只做一次 (批次为1时整批共用)
+        overlay_rgba, offset_x, offset_y = cached_transform(overlay_image, placement_key(placement), workers, resample)
+        # 计算位置
+        x = int(placement["x"]) + offset_x
+        y = int(placement["y"]) + offset_y
+        paste(base_u8, mask_np, overlay_rgba, x, y, blend_mode, workers, mask_mode, blend_path)
+
+    return base_u8, mask_np
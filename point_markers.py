@@ -0,0 +1,78 @@
+import functools
+
+import numpy as np
+import torch
+
+# 坐标点标记渲染: 每种尺寸的圆形模板只计算一次, 通过切片一次性印到整批图像上
+
+COLOR_MAP = {
+    "red": (255, 0, 0),
+    "blue": (0, 0, 255),
+    "green": (0, 255, 0),
+    "yellow": (255, 255, 0),
+    "white": (255, 255, 255)
+}
+
+
+@functools.lru_cache(maxsize=64)
+def _disc_stencil(size, antialias):
+    offsets = np.arange(-size, size + 1, dtype=np.float32)
+    distance_sq = offsets[None, :] ** 2 + offsets[:, None] ** 2
+    if antialias:
+        # 边缘按到圆周的距离做线性覆盖率
+        coverage = np.clip(size + 0.5 - np.sqrt(distance_sq), 0.0, 1.0)
+    else:
+        coverage = (distance_sq <= size * size).astype(np.float32)
+    return torch.from_numpy(coverage)
+
+
+def disc_stencil(size, antialias=False, device="cpu"):
+    # (2*size+1, 2*size+1) 覆盖率模板
+    return _disc_stencil(int(size), bool(antialias)).to(device)
+
+
+def to_rgb(images):
+    # 转成 (B, H, W, 3) float32 的新张量, 作为绘制目标
+    if isinstance(images, np.ndarray):
+        images = torch.from_numpy(images)
+    if images.dim() == 3:
+        images = images.unsqueeze(0)
+    if images.shape[-1] == 1:
+        return images.float().repeat(1, 1, 1, 3)
+    return images[..., :3].float().clone()
+
+
+@functools.lru_cache(maxsize=64)
+def _marker_layer(size, antialias, color, device):
+    stencil = disc_stencil(size, antialias, device)
+    rgb = torch.tensor(COLOR_MAP.get(color, COLOR_MAP["red"]), dtype=torch.float32, device=device) / 255.0
+    return rgb.expand(stencil.shape + (3,)), stencil[..., None]
+
+
+def marker_layer(size, color, antialias=False, device="cpu"):
+    # 标记图层: ((2*size+1, 2*size+1, 3) 颜色, (2*size+1, 2*size+1, 1) 覆盖率), 按尺寸/颜色缓存
+    return _marker_layer(int(size), bool(antialias), color, str(device))
+
+
+def stamp_marker(canvas, x, y, layer):
+    # 只在标记所在的小块区域内把图层混合到画布 (原地), 超出画布的部分被裁掉
+    rgb, coverage = layer
+    size = coverage.shape[0] // 2
+    height, width = canvas.shape[1:3]
+    x0, y0 = max(x - size, 0), max(y - size, 0)
+    x1, y1 = min(x + size + 1, width), min(y + size + 1, height)
+    if x0 >= x1 or y0 >= y1:
+        return
+    rows = slice(y0 - (y - size), y1 - (y - size))
+    cols = slice(x0 - (x - size), x1 - (x - size))
+    canvas[:, y0:y1, x0:x1].lerp_(rgb[rows, cols], coverage[rows, cols])
+
+
+def draw_points(images, points, color, size, antialias=False):
+    # 在整批图像的每个点上绘制圆形标记, points 为 [(x, y), ...] 或 Nx2 数组
+    # 输入图像只转换/复制一次 (to_rgb), 标记逐个印到各自的小块区域
+    canvas = to_rgb(images)
+    layer = marker_layer(size, color, antialias, canvas.device)
+    for x, y in np.asarray(points, dtype=np.int64).reshape(-1, 2).tolist():
+        stamp_marker(canvas, x, y, layer)
+    return canvas
@@ -0,0 +1,56 @@
+import argparse
+import json
+import os
+import sys
+import time
+
+# 在ComfyUI之外批量合成: 借用 benchmarks/common.py 的包加载器, 调用 batch_runner.run_batch
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "benchmarks"))
+
+from common import load_module
+
+
+def main():
+    options = load_module("options")
+    parser = argparse.ArgumentParser(description="HBH image overlay 批量合成")
+    parser.add_argument("input", help="底图目录, 或清单文件 (.json 列表 / 每行一个路径的文本)")
+    parser.add_argument("--overlay", required=True, help="修改图路径")
+    parser.add_argument("--output", required=True, help="输出目录")
+    parser.add_argument("--coordinates", default='[{"x": 0, "y": 0}]', help="坐标JSON, 清单中的条目可单独指定")
+    parser.add_argument("--scale", type=float, default=1.0)
+    parser.add_argument("--rotation", type=float, default=0.0)
+    parser.add_argument("--flip-horizontal", action="store_true")
+    parser.add_argument("--flip-vertical", action="store_true")
+    parser.add_argument("--blend-mode", choices=options.BLEND_MODES, default="normal")
+    parser.add_argument("--opacity", type=float, default=1.0)
+    parser.add_argument("--format", dest="output_format", choices=["png", "jpg", "webp"], default="png")
+    parser.add_argument("--quality", type=int, default=95, help="jpg/webp 质量")
+    parser.add_argument("--backend", choices=["tensor", "pil"], default="tensor")
+    parser.add_argument("--placement", choices=["first", "all"], default="first")
+    parser.add_argument("--alpha-mode", choices=["straight", "premultiplied"], default="straight")
+    parser.add_argument("--resample", choices=options.RESAMPLE_FILTERS, default="legacy")
+    parser.add_argument("--workers", type=int, default=0, help="合成线程数, 0 为自动")
+    parser.add_argument("--io-workers", type=int, default=4, help="解码/编码线程数")
+    parser.add_argument("--recursive", action="store_true", help="递归读取子目录")
+    parser.add_argument("--skip-existing", action="store_true", help="跳过已存在的输出")
+    args = parser.parse_args()
+
+    batch_runner = load_module("batch_runner")
+    start = time.perf_counter()
+    summary = batch_runner.run_batch(
+        args.input, args.overlay, args.output,
+        coordinates=args.coordinates, scale=args.scale, rotation=args.rotation,
+        flip_horizontal=args.flip_horizontal, flip_vertical=args.flip_vertical,
+        blend_mode=args.blend_mode, opacity=args.opacity, output_format=args.output_format,
+        io_workers=args.io_workers, quality=args.quality, recursive=args.recursive, skip_existing=args.skip_existing,
+        backend=args.backend, placement=args.placement, alpha_mode=args.alpha_mode, resample=args.resample, workers=args.workers,
+    )
+    elapsed = time.perf_counter() - start
+    rate = summary["done"] / elapsed * 3600 if elapsed > 0 else 0.0
+    print(json.dumps({"done": summary["done"], "skipped": summary["skipped"], "failed": len(summary["failed"]),
+                      "seconds": round(elapsed, 2), "images_per_hour": round(rate)}))
+    return 1 if summary["failed"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
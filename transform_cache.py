@@ -0,0 +1,109 @@
+import hashlib
+import threading
+import weakref
+from collections import OrderedDict
+
+import numpy as np
+import torch
+
+# 变换后修改图的LRU缓存, 由 ImageOverlayNode 和 ImageOverlayPreviewNode 共用
+# 键为修改图内容哈希加变换参数, 同时限制条目数和总字节数
+
+
+def _nbytes(value):
+    if isinstance(value, torch.Tensor):
+        return value.numel() * value.element_size()
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, (tuple, list)):
+        return sum(_nbytes(v) for v in value)
+    return 0
+
+
+class TransformCache:
+    def __init__(self, max_entries=64, max_bytes=512 * 1024 * 1024):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = _nbytes(value)
+        with self.lock:
+            if key in self.entries:
+                self.total_bytes -= self.entries.pop(key)[1]
+            # 单个条目超过字节上限时不缓存
+            if size > self.max_bytes:
+                return value
+            self.entries[key] = (value, size)
+            self.total_bytes += size
+            while len(self.entries) > self.max_entries or self.total_bytes > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last=False)
+                self.total_bytes -= evicted
+        return value
+
+    def get_or_create(self, key, factory):
+        value = self.get(key)
+        if value is None:
+            value = self.put(key, factory())
+        return value
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.total_bytes = 0
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.total_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+
+TRANSFORM_CACHE = TransformCache()
+
+# 同一个张量对象在内容未被原地修改前只哈希一次; 张量的 __eq__ 是逐元素比较, 所以按 id 记录
+_digest_memo = {}
+
+
+def _forget(key):
+    _digest_memo.pop(key, None)
+
+
+def tensor_digest(tensor):
+    # 内容哈希 (形状 + 类型 + 数据)
+    if isinstance(tensor, torch.Tensor):
+        memo = _digest_memo.get(id(tensor))
+        if memo is not None and memo[0]() is tensor and memo[1] == tensor._version:
+            return memo[2]
+        array = tensor.detach().cpu().contiguous().numpy()
+    else:
+        array = np.ascontiguousarray(tensor)
+
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str((array.shape, array.dtype.str)).encode())
+    digest.update(memoryview(array).cast("B"))
+    result = digest.hexdigest()
+
+    if isinstance(tensor, torch.Tensor):
+        key = id(tensor)
+        _digest_memo[key] = (weakref.ref(tensor, lambda _, key=key: _forget(key)), tensor._version, result)
+    return result